@@ -1,51 +1,24 @@
 import sys
 sys.path.insert(0, "..")
+import itertools
 import termenu
+from termenu.itersource import IteratorSource
 
 """
 This example shows how you could implement a menu for a very long (or endless)
-list of options.
+list of options, read from an iterator as the menu is scrolled.
 """
 
-class IteratorList(object):
-    def __init__(self, iter):
-        self._iter = iter
-        self._list = []
+def records(start=0):
+    for n in itertools.count(start):
+        yield ("record %09d" % n, n)
 
-    def __getitem__(self, index):
-        try:
-            while index >= len(self._list):
-                self._list.append(self._iter.next())
-        except StopIteration:
-            pass
-        return self._list[index]
-
-    def __slice__(self, i, j):
-        self[j]
-        return self._list[i:j]
-
-def show_long_menu(optionsIter, pagesize=30):
-    Next = object()
-    Previous = object()
-    options = IteratorList("%05d" % n for n in optionsIter)
-    start = 0
-    while True:
-        page = options[start:start+pagesize]
-        if len(page) == pagesize:
-            page.append((">>", Next))
-        if start > 0:
-            page.insert(0, ("<<", Previous))
-        result = termenu.Termenu(page, multiselect=False).show()
-        if not result:
-            break
-        if result == Next:
-            start = start + pagesize
-        elif result == Previous:
-            start = start - pagesize
-        else:
-            break
-
-    return result
+def show_long_menu(pagesize=30):
+    # records can be read again from any index, so only the rows around the
+    # cursor are kept in memory
+    source = IteratorSource(records(), prefetch=5 * pagesize, reopen=records, keep=10000)
+    menu = termenu.Termenu(source, height=pagesize, multiselect=False, heartbeat=0.1)
+    return menu.show()
 
 if __name__ == "__main__":
-    show_long_menu(xrange(500))
+    print(show_long_menu())
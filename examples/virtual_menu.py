@@ -0,0 +1,26 @@
+import sys
+sys.path.insert(0, "..")
+import termenu
+
+"""
+This example shows how to display a huge list of options without creating
+them up front, using an OptionSource that computes options on demand.
+"""
+
+class SquaresSource(termenu.OptionSource):
+    def __init__(self, count):
+        self._count = count
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        return ("%d squared is %d" % (index, index * index), index)
+
+    def width_hint(self):
+        n = self._count - 1
+        return len(self[n][0])
+
+if __name__ == "__main__":
+    menu = termenu.Termenu(SquaresSource(10**7), multiselect=False, plugins=[termenu.FilterPlugin()])
+    print(menu.show())
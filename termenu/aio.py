@@ -0,0 +1,65 @@
+import asyncio
+from . import keyboard
+from .instrument import clock
+
+async def keyboard_batches(heartbeat=None):
+    """
+    Like keyboard.keyboard_batches, but waits for stdin through the running
+    event loop so other tasks keep running between keys.
+    """
+    loop = asyncio.get_running_loop()
+    ready = asyncio.Event()
+    loop.add_reader(keyboard.STDIN, ready.set)
+    loop.add_reader(keyboard._wakeup_fd(), ready.set)
+    try:
+        with keyboard.RawTerminal(blocking=False) as terminal:
+            sequence = ""
+            while True:
+                try:
+                    # a split key sequence only gets a moment to complete
+                    timeout = keyboard.ESC_TIMEOUT if sequence else heartbeat
+                    await asyncio.wait_for(ready.wait(), timeout)
+                except asyncio.TimeoutError:
+                    if sequence:
+                        keys, sequence = keyboard._decode(sequence, final=True)
+                        yield keys
+                        continue
+                ready.clear()
+                keys, sequence = keyboard._decode(sequence + keyboard._read_available(terminal))
+                keys = keyboard._take_posted() + keys
+                if keys or not sequence:
+                    yield keys or ["heartbeat"]
+    finally:
+        loop.remove_reader(keyboard.STDIN)
+        loop.remove_reader(keyboard._wakeup_fd())
+
+async def keyboard_listener(heartbeat=None):
+    async for keys in keyboard_batches(heartbeat):
+        for key in keys:
+            yield key
+
+async def show(menu):
+    """
+    The body of Termenu.show_async.
+    """
+    with menu._measuring():
+        menu._show_start()
+    batches = keyboard_batches(menu._heartbeat)
+    try:
+        while True:
+            start = menu._tracer and clock()
+            try:
+                keys = await batches.__anext__()
+            except StopAsyncIteration:
+                return
+            if start:
+                menu._tracer.complete("read keys", start, clock(), dict(keys=keys), category="input")
+            with menu._measuring():
+                stop = menu._show_keys(keys)
+            if stop:
+                return menu.get_result()
+    finally:
+        # restore the terminal before the menu is cleared
+        await batches.aclose()
+        with menu._measuring():
+            menu._show_end()
@@ -4,19 +4,98 @@ import errno
 import sys
 import re
 import os
+import contextlib
+import array
+import bisect
+import threading
+from .instrument import clock
+
+try:
+    xrange()
+except:
+    xrange = range
 
 COLORS = dict(black=0, red=1, green=2, yellow=3, blue=4, magenta=5, cyan=6, white=7, default=9)
 
+# pending output while inside buffered(), None otherwise
+_buffer = None
+
+# called after every write, see add_write_observer
+_observers = []
+
+# per thread, called after the writes inside an observing() block
+_local = threading.local()
+
 def write(text):
+    if _buffer is not None:
+        _buffer.append(text)
+    else:
+        _write(text)
+
+def _write(text):
+    data = text.encode("utf8")
     written = 0
+    syscalls = 0
+    observer = getattr(_local, "observer", None)
+    start = (_observers or observer) and clock()
     fd = sys.stdout.fileno()
-    while written < len(text):
-        remains = text[written:].encode("utf8")
+    while written < len(data):
+        syscalls += 1
         try:
-            written += os.write(fd, remains)
+            written += os.write(fd, data[written:])
         except OSError as e:
             if e.errno != errno.EAGAIN:
                 raise
+    if start:
+        end = clock()
+        for each in _observers:
+            each(len(data), syscalls, start, end)
+        if observer is not None:
+            observer(len(data), syscalls, start, end)
+
+def add_write_observer(observer):
+    """
+    Call observer(bytes, syscalls, start, end) after every write to the
+    terminal, with the clock() times the write started and ended.
+    """
+    _observers.append(observer)
+
+def remove_write_observer(observer):
+    _observers.remove(observer)
+
+@contextlib.contextmanager
+def observing(observer):
+    """
+    Call observer(bytes, syscalls, start, end) after every write this thread
+    makes inside the block, except inside nested observing() blocks, which
+    replace it. None observes nothing.
+    """
+    previous = getattr(_local, "observer", None)
+    _local.observer = observer
+    try:
+        yield
+    finally:
+        _local.observer = previous
+
+@contextlib.contextmanager
+def buffered():
+    """
+    Collect everything written inside the block and write it out with a single
+    syscall at the end, so the terminal never sees a partially drawn frame.
+    """
+    global _buffer
+    if _buffer is not None:
+        # already buffering, the outermost block writes everything
+        yield
+        return
+    _buffer = []
+    try:
+        yield
+    finally:
+        text = "".join(_buffer)
+        _buffer = None
+        if text:
+            _write(text)
 
 def up(n=1):
     write("\x1b[%dA" % n)
@@ -36,6 +115,12 @@ def move_horizontal(column=1):
 def move(row, column):
     write("\x1b[%d;%dH" % (row, column))
 
+def insert_lines(n=1):
+    write("\x1b[%dL" % n)
+
+def delete_lines(n=1):
+    write("\x1b[%dM" % n)
+
 def clear_screen():
     write("\x1b[2J")
 
@@ -74,34 +159,84 @@ ANSI_COLOR_REGEX = "\x1b\[(\d+)?(;\d+)*;?m"
 def decolorize(string):
     return re.sub(ANSI_COLOR_REGEX, "", string)
 
+_ANSI_COLOR_PATTERN = re.compile(ANSI_COLOR_REGEX)
+
 class ansistr(str):
+    """
+    A string with embedded color sequences whose length and slices only count
+    the visible characters. Slices keep the color sequences around the visible
+    text, so the colors of the sliced part stay the same.
+    """
     def __init__(self, s):
-        if not isinstance(s, str):
-            s = str(s)
-        self.__str = s
-        self.__parts = [m.span() for m in re.finditer("(%s)|(.)" % ANSI_COLOR_REGEX, s)]
-        self.__len = sum(1 if p[1]-p[0]==1 else 0 for p in self.__parts)
+        # for every color sequence, the number of visible characters before it
+        # and its raw start and end offsets
+        self._before = None
+        self._spans = None
+        self._len = str.__len__(self)
+        for match in _ANSI_COLOR_PATTERN.finditer(self):
+            if self._before is None:
+                self._before = array.array("I")
+                self._spans = array.array("I")
+            start, end = match.span()
+            self._len -= end - start
+            self._before.append(self._raw_offset(len(self._before), start))
+            self._spans.extend((start, end))
+
+    def _raw_offset(self, count, offset):
+        # the visible position of a raw offset that follows the first `count`
+        # color sequences
+        if count == 0:
+            return offset
+        return offset - (self._spans[2*count-1] - self._before[count-1])
+
+    def _raw(self, pos):
+        # raw offset of the visible character at `pos`
+        if self._before is None:
+            return pos
+        count = bisect.bisect_right(self._before, pos)
+        if count == 0:
+            return pos
+        return pos + (self._spans[2*count-1] - self._before[count-1])
+
+    def _sequences(self, first, last):
+        spans = self._spans
+        return "".join(str.__getitem__(self, slice(spans[2*k], spans[2*k+1])) for k in xrange(first, last))
 
     def __len__(self):
-        return self.__len
+        return self._len
+
+    def __getitem__(self, index):
+        if not isinstance(index, slice):
+            if index < 0:
+                index += self._len
+            if not 0 <= index < self._len:
+                raise IndexError("string index out of range")
+            return str.__getitem__(self, self._raw(index))
+        start, stop, step = index.indices(self._len)
+        if step != 1:
+            return ansistr("".join(self[i] for i in xrange(start, stop, step)))
+        stop = max(start, stop)
+        if self._before is None:
+            return ansistr(str.__getitem__(self, slice(start, stop)))
+        # sequences before the slice set up its colors, the ones after it
+        # restore them
+        first = bisect.bisect_right(self._before, start)
+        last = bisect.bisect_right(self._before, stop)
+        return ansistr(self._sequences(0, first) +
+                       str.__getitem__(self, slice(self._raw(start), self._raw(stop))) +
+                       self._sequences(last, len(self._before)))
 
     def __getslice__(self, i, j):
-        parts = []
-        count = 0
-        for start, end in self.__parts:
-            if end - start == 1:
-                count += 1
-                if i <= count < j:
-                    parts.append(self.__str[start:end])
-            else:
-                parts.append(self.__str[start:end])
-        return ansistr("".join(parts))
+        return self.__getitem__(slice(i, j))
 
     def __add__(self, s):
-        return ansistr(self.__str + s)
+        return ansistr(str.__add__(self, s))
+
+    def __radd__(self, s):
+        return ansistr(s + str(self))
 
     def decolorize(self):
-        return decolorize(self.__str)
+        return decolorize(self)
 
 if __name__ == "__main__":
     # Print all colors
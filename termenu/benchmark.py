@@ -0,0 +1,235 @@
+"""
+Microbenchmarks for termenu's hot paths.
+
+    python -m termenu.benchmark [-s 1000,100000] [-o results.json] [-b baseline.json]
+
+Every benchmark runs for each option count given with --sizes and for each
+of its own parameters. Results can be saved as JSON and a previous run can be
+given as a baseline, in which case benchmarks that got slower by more than
+the tolerance are reported and the exit status is 1.
+"""
+
+from __future__ import print_function
+
+import sys
+import json
+import random
+import platform
+import itertools
+import contextlib
+from optparse import OptionParser
+
+from termenu import ansi, keyboard
+from termenu.menu import Termenu, FilterPlugin, OptionGroup, OptionGroupPlugin, shorten
+from termenu.version import version
+from termenu.instrument import clock
+
+SIZES = (1000, 10000, 100000)
+WORDS = ("alpha", "bravo", "charlie", "delta", "echo", "foxtrot", "golf", "hotel", "india", "juliet")
+# typed into the filter, a prefix of its length is used as the query
+QUERY = "echo 1234"
+
+BENCHMARKS = []
+
+def benchmark(**params):
+    """
+    Register a benchmark. The decorated function is called with `options` and
+    one value of each of `params`, does its setup and returns the function to
+    time, which may return a function that resets it between runs.
+    """
+    def register(func):
+        BENCHMARKS.append((func.__name__, func, params))
+        return func
+    return register
+
+def make_options(count, seed=0):
+    rand = random.Random(seed)
+    return ["%s %d %s" % (rand.choice(WORDS), i, rand.choice(WORDS)) for i in range(count)]
+
+@contextlib.contextmanager
+def captured_output():
+    # count the menu's output instead of writing it to the terminal
+    written = []
+    original = ansi._write
+    ansi._write = written.append
+    try:
+        yield written
+    finally:
+        ansi._write = original
+
+@benchmark(query=(1, 3, 9))
+def refilter(options, query):
+    plugin = FilterPlugin()
+    menu = Termenu(make_options(options), height=20, plugins=[plugin])
+    def run():
+        plugin.text = list(QUERY[:query])
+        plugin._results = []
+        plugin._refilter()
+    return run
+
+@benchmark(query=(1, 3, 9))
+def refilter_fuzzy(options, query):
+    plugin = FilterPlugin(fuzzy=True)
+    menu = Termenu(make_options(options), height=20, plugins=[plugin])
+    def run():
+        plugin.text = list(QUERY[:query])
+        plugin._results = []
+        plugin._refilter()
+    return run
+
+@benchmark(query=(9,))
+def type_query(options, query):
+    # one key at a time, every key narrows the previous matches
+    plugin = FilterPlugin()
+    menu = Termenu(make_options(options), height=20, plugins=[plugin])
+    def run():
+        plugin._results = []
+        plugin.text = None
+        for key in QUERY[:query]:
+            menu._on_key(key)
+    return run
+
+@benchmark(height=(10, 50))
+def print_menu(options, height):
+    # scroll down a page, one frame per key
+    menu = Termenu(make_options(options), height=height, plugins=[FilterPlugin()])
+    def run():
+        with captured_output():
+            for i in range(height):
+                menu._on_key("down")
+                with ansi.buffered():
+                    menu._goto_top()
+                    menu._print_menu()
+    def reset():
+        menu.cursor = menu.scroll = 0
+        menu._clear_cache()
+    return run, reset
+
+@benchmark(height=(10, 50))
+def decorate(options, height):
+    # what _print_menu does for every row of a full redraw
+    menu = Termenu(make_options(options), height=height, plugins=[OptionGroupPlugin(), FilterPlugin()])
+    def run():
+        for index, option in enumerate(menu._get_window()):
+            menu._decorate(menu._adjust_width(option.text), **menu._decorate_flags(index))
+    return run
+
+@benchmark()
+def ansistr_create(options):
+    lines = [ansi.colorize(text[:6], "yellow") + text[6:] for text in make_options(options)]
+    def run():
+        for line in lines:
+            ansi.ansistr(line)
+    return run
+
+@benchmark(width=(20,))
+def ansistr_shorten(options, width):
+    lines = [ansi.ansistr(ansi.colorize(text, "yellow") + " " + text) for text in make_options(options)]
+    def run():
+        for line in lines:
+            shorten(line, width)
+    return run
+
+@benchmark(group=(100,))
+def option_groups(options, group):
+    texts = make_options(options)
+    groups = [OptionGroup("group %d" % i, texts[i:i+group]) for i in range(0, options, group)]
+    menu = Termenu(groups[:1], plugins=[OptionGroupPlugin()])
+    def run():
+        menu._make_option_objects(groups)
+    return run
+
+@benchmark()
+def keyboard_decode(options):
+    # a paste of `options` characters with an arrow key every ten
+    sequence = "".join("abcdefghi" + keyboard.ANSI_SEQUENCES["down"] for i in range(options // 10))
+    def run():
+        keyboard._decode(sequence)
+    return run
+
+def measure(func, repeat):
+    """
+    Time `func` `repeat` times after a warmup run and return the times.
+    """
+    run = func
+    reset = None
+    if isinstance(func, tuple):
+        run, reset = func
+    times = []
+    for i in range(repeat + 1):
+        if reset:
+            reset()
+        start = clock()
+        run()
+        times.append(clock() - start)
+    return times[1:]
+
+def result_id(result):
+    params = ",".join("%s=%s" % item for item in sorted(result["params"].items()))
+    return "%s[%s]" % (result["name"], params)
+
+def run_benchmarks(sizes=SIZES, names=None, repeat=5, report=None):
+    results = []
+    for name, func, params in BENCHMARKS:
+        if names and not any(n in name for n in names):
+            continue
+        keys = sorted(params)
+        for options in sizes:
+            for values in itertools.product(*[params[k] for k in keys]):
+                kwargs = dict(zip(keys, values))
+                times = measure(func(options, **kwargs), repeat)
+                kwargs["options"] = options
+                result = dict(name=name, params=kwargs, best=min(times), median=sorted(times)[len(times)//2], repeat=repeat)
+                results.append(result)
+                if report:
+                    report(result)
+    return results
+
+def compare(results, baseline, tolerance=0.25):
+    """
+    Return (id, baseline time, time) for every result that is slower than its
+    baseline by more than `tolerance`.
+    """
+    previous = dict((result_id(r), r["best"]) for r in baseline)
+    regressions = []
+    for result in results:
+        old = previous.get(result_id(result))
+        if old and result["best"] > old * (1 + tolerance):
+            regressions.append((result_id(result), old, result["best"]))
+    return regressions
+
+def main(argv=None):
+    parser = OptionParser(usage="Usage: python -m termenu.benchmark [options] [names]")
+    parser.add_option("-s", "--sizes", help="Comma separated option counts [%s]" % ",".join(str(s) for s in SIZES), default=None)
+    parser.add_option("-r", "--repeat", type="int", help="Times to run every benchmark [5]", default=5)
+    parser.add_option("-o", "--output", help="Save the results as JSON", metavar="FILE")
+    parser.add_option("-b", "--baseline", help="Compare to results saved with --output", metavar="FILE")
+    parser.add_option("-t", "--tolerance", type="float", help="Allowed slowdown against the baseline [0.25]", default=0.25)
+    (options, args) = parser.parse_args(argv)
+
+    sizes = SIZES
+    if options.sizes:
+        sizes = [int(float(s)) for s in options.sizes.split(",")]
+
+    def report(result):
+        print("%-50s %10.3fms" % (result_id(result), result["best"] * 1000))
+        sys.stdout.flush()
+    results = run_benchmarks(sizes, args, options.repeat, report)
+
+    if options.output:
+        data = dict(version=version, python=platform.python_version(), results=results)
+        with open(options.output, "w") as f:
+            json.dump(data, f, indent=2, sort_keys=True)
+
+    if options.baseline:
+        with open(options.baseline) as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline["results"], options.tolerance)
+        for name, old, new in regressions:
+            print("REGRESSION %s: %.3fms -> %.3fms (%+.0f%%)" % (name, old * 1000, new * 1000, (new / old - 1) * 100))
+        if regressions:
+            return 1
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,255 @@
+import os
+import re
+import sys
+import mmap
+import array
+import bisect
+import struct
+import hashlib
+from .menu import OptionSource
+
+# a file is indexed this many bytes at a time
+CHUNK_SIZE = 16 * 1024 * 1024
+
+# whitespace that normalizing a line collapses, except the line separator
+_SPACE = b"[^\\S\\n]+"
+
+def _normalize(text):
+    # strip and collapse whitespace like `termenu` does to its input lines
+    return " ".join(text.split())
+
+class FileSource(OptionSource):
+    """
+    The lines of a file as menu options, with whitespace normalized and,
+    if `unique` is set, without repeated lines. The file is memory mapped and
+    only the start offset of every line is kept; lines are decoded when they
+    are shown and filtering searches the mapped bytes.
+
+    With an IndexCache the line offsets and a lowercased copy of the file for
+    searching are kept on disk and reused while the file doesn't change.
+    """
+    def __init__(self, path, unique=True, encoding="utf8", cache=None):
+        self.path = path
+        self.encoding = encoding
+        with open(path, "rb") as f:
+            try:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            except ValueError:
+                # empty files can't be mapped
+                self._map = b""
+        # lowercased copy of the file with the same offsets, if cached
+        self._lower = None
+        index = cache.load(path, unique) if cache and self._map else None
+        if index is None:
+            self._starts, self._longest = self._index(unique)
+            if cache and self._map:
+                cache.store(path, unique, self._starts, self._longest, self._map)
+        else:
+            self._starts, self._longest, self._lower = index
+
+    def _index(self, unique):
+        starts = array.array("Q")
+        longest = 0
+        data = self._map
+        if unique:
+            # open addressing table of kept line numbers + 1 by the hash of the
+            # normalized line, 0 marks a free slot. The low bits of the hashes
+            # of kept lines tell most lines apart without reading them again.
+            lines = sum(data[i:i + CHUNK_SIZE].count(b"\n") for i in range(0, len(data), CHUNK_SIZE)) + 1
+            mask = (1 << (lines + lines // 2).bit_length()) - 1
+            table = array.array("I" if lines < 2**32 - 1 else "Q")
+            table.frombytes(bytes(table.itemsize * (mask + 1)))
+            hashes = array.array("I")
+        offset = 0
+        size = len(data)
+        while offset < size:
+            end = data.rfind(b"\n", offset, offset + CHUNK_SIZE)
+            if end < 0 or offset + CHUNK_SIZE >= size:
+                end = size
+            chunk = data[offset:end].split(b"\n")
+            if end == size and chunk[-1] == b"":
+                # the newline at the end of the file doesn't start a line
+                chunk.pop()
+            for line in chunk:
+                key = b" ".join(line.split())
+                if unique:
+                    keyHash = hash(key)
+                    short = keyHash & 0xffffffff
+                    slot = keyHash & mask
+                    kept = table[slot]
+                    while kept and (hashes[kept - 1] != short or self._line_key(starts[kept - 1]) != key):
+                        slot = (slot + 1) & mask
+                        kept = table[slot]
+                    if kept:
+                        offset += len(line) + 1
+                        continue
+                    table[slot] = len(starts) + 1
+                    hashes.append(short)
+                starts.append(offset)
+                longest = max(longest, len(key))
+                offset += len(line) + 1
+            offset = end + 1
+        return starts, longest
+
+    def _line(self, start):
+        end = self._map.find(b"\n", start)
+        if end < 0:
+            end = len(self._map)
+        return self._map[start:end]
+
+    def _line_key(self, start):
+        return b" ".join(self._line(start).split())
+
+    def __len__(self):
+        return len(self._starts)
+
+    def __getitem__(self, index):
+        return _normalize(self._line(self._starts[index]).decode(self.encoding, "replace"))
+
+    def width_hint(self):
+        # in bytes, more than the characters of lines that aren't ASCII
+        return self._longest
+
+    def search(self, text, indices=None):
+        try:
+            needle = text.encode("ascii")
+        except UnicodeError:
+            # can't match non-ASCII case-insensitively in bytes
+            return None
+        if indices is not None and len(indices) * 8 < len(self):
+            # few candidates, check them one by one
+            return array.array("L", (i for i in indices if text in self[i].lower()))
+
+        # whitespace in the query matches any run of whitespace in the file
+        pattern = _SPACE.join(re.escape(word) for word in needle.split(b" "))
+        if self._lower is not None:
+            data = self._lower
+            pattern = re.compile(pattern)
+        else:
+            data = self._map
+            pattern = re.compile(pattern, re.IGNORECASE)
+        # normalizing whitespace can't change a match without whitespace
+        verify = b" " in needle
+        candidates = None if indices is None else set(indices)
+        starts = self._starts
+        matches = array.array("L")
+        pos = 0
+        while True:
+            match = pattern.search(data, pos)
+            if match is None:
+                break
+            lineStart = data.rfind(b"\n", 0, match.start()) + 1
+            index = bisect.bisect_left(starts, lineStart)
+            # lines that aren't in the index are duplicates of earlier lines,
+            # which match too
+            if index < len(starts) and starts[index] == lineStart:
+                if (candidates is None or index in candidates) and (not verify or text in self[index].lower()):
+                    matches.append(index)
+            pos = data.find(b"\n", match.start())
+            if pos < 0:
+                break
+        return matches
+
+class IndexCache(object):
+    """
+    A directory of FileSource indices, keyed by the path, modification time
+    and size of the indexed file. When the cached files grow beyond
+    `maxSize` bytes the least recently used indices are removed.
+    """
+    MAGIC = b"TMNUIDX2"
+    HEADER = struct.Struct("<8sQQ")
+
+    def __init__(self, directory, maxSize=4 * 1024**3):
+        self.directory = directory
+        self.maxSize = maxSize
+
+    def _key(self, path, unique):
+        stat = os.stat(path)
+        key = "%s\0%r\0%d\0%d\0%s" % (os.path.abspath(path), stat.st_mtime, stat.st_size, unique, sys.byteorder)
+        return os.path.join(self.directory, hashlib.sha1(key.encode("utf8")).hexdigest()), stat.st_size
+
+    def load(self, path, unique):
+        """
+        Return (line offsets, longest line, lowercased file) mapped from the
+        cache, or None if the file wasn't indexed since it last changed.
+        """
+        key, size = self._key(path, unique)
+        try:
+            with open(key + ".index", "rb") as f:
+                index = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            with open(key + ".lower", "rb") as f:
+                lower = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        except (IOError, OSError, ValueError):
+            return None
+        if len(index) < self.HEADER.size:
+            # cut short, e.g. by a full disk
+            return None
+        magic, count, longest = self.HEADER.unpack_from(index)
+        if magic != self.MAGIC or len(index) != self.HEADER.size + count * 8 or len(lower) != size:
+            return None
+        # mark as recently used
+        for suffix in (".index", ".lower"):
+            os.utime(key + suffix, None)
+        starts = memoryview(index)[self.HEADER.size:].cast("Q")
+        return starts, longest, lower
+
+    def store(self, path, unique, starts, longest, data):
+        """
+        Save the index of a file and a lowercased copy of its mapped `data`.
+        The cache is only an optimization, so if it can't be written, e.g.
+        because the directory is read-only or the disk is full, nothing is
+        saved.
+        """
+        key, size = self._key(path, unique)
+        # written under temporary names so readers never see partial files,
+        # offsets are in native byte order, which is part of the key
+        temp = ".%d.tmp" % os.getpid()
+        try:
+            if not os.path.isdir(self.directory):
+                os.makedirs(self.directory)
+            with open(key + ".lower" + temp, "wb") as f:
+                for start in range(0, len(data), CHUNK_SIZE):
+                    f.write(data[start:start+CHUNK_SIZE].lower())
+            with open(key + ".index" + temp, "wb") as f:
+                f.write(self.HEADER.pack(self.MAGIC, len(starts), longest))
+                f.write(starts.tobytes())
+            os.rename(key + ".lower" + temp, key + ".lower")
+            os.rename(key + ".index" + temp, key + ".index")
+        except (IOError, OSError):
+            for suffix in (".lower", ".index"):
+                try:
+                    os.remove(key + suffix + temp)
+                except OSError:
+                    pass
+            return
+        self._evict(os.path.basename(key))
+
+    def _evict(self, keep):
+        # key -> [total size, last used, file names]
+        entries = {}
+        try:
+            names = os.listdir(self.directory)
+        except OSError:
+            return
+        for name in names:
+            try:
+                stat = os.stat(os.path.join(self.directory, name))
+            except OSError:
+                # evicted by another process meanwhile
+                continue
+            entry = entries.setdefault(name.split(".")[0], [0, 0, []])
+            entry[0] += stat.st_size
+            entry[1] = max(entry[1], stat.st_mtime)
+            entry[2].append(name)
+        total = sum(entry[0] for entry in entries.values())
+        for key in sorted(entries, key=lambda k: entries[k][1]):
+            if total <= self.maxSize:
+                break
+            if key == keep:
+                continue
+            for name in entries[key][2]:
+                try:
+                    os.remove(os.path.join(self.directory, name))
+                except OSError:
+                    pass
+            total -= entries[key][0]
@@ -0,0 +1,347 @@
+"""
+Run menus in a pseudo-terminal without a real one, for end-to-end tests and
+measurements.
+
+    terminal = HeadlessTerminal(lambda: termenu.Termenu(options).show())
+    terminal.start()
+    frame = terminal.send("down")
+    print(frame.latency, frame.bytes, terminal.screen.lines())
+    result = terminal.send("enter") and terminal.wait()
+
+The menu runs in a forked child whose stdin and stdout are the pty, so
+keyboard and ansi work unchanged. The output is parsed into a VirtualScreen.
+"""
+
+from __future__ import print_function
+
+import os
+import re
+import sys
+import pty
+import time
+import errno
+import fcntl
+import struct
+import pickle
+import select
+import termios
+
+from termenu import keyboard
+
+def _key_sequence(key):
+    # a key name as read by keyboard, or text to type
+    if key in keyboard.ANSI_SEQUENCES:
+        return keyboard.ANSI_SEQUENCES[key]
+    for seq, name in keyboard.KEY_NAMES.items():
+        if name == key and len(seq) == 1:
+            return seq
+    return key
+
+_TOKEN = re.compile(r"\x1b\[(\??)([0-9;]*)([@-~])|\x1b([78])|[\x00-\x1f]|[^\x00-\x1f\x1b]+")
+_INCOMPLETE = re.compile(r"\x1b(\[[0-9;?]*)?$")
+
+class VirtualScreen(object):
+    """
+    A screen buffer that understands the escape sequences termenu writes:
+    cursor movement, save/restore, clearing, line insertion/deletion and
+    colors, which are kept per cell as the SGR parameters in effect.
+    """
+    def __init__(self, rows=24, columns=80):
+        self.rows = rows
+        self.columns = columns
+        self.chars = [[" "] * columns for i in range(rows)]
+        self.attrs = [[()] * columns for i in range(rows)]
+        self.row = 0
+        self.column = 0
+        self.cursorVisible = True
+        self._wrap = False
+        self._saved = (0, 0)
+        self._sgr = ()
+        self._pending = ""
+
+    def feed(self, text):
+        text = self._pending + text
+        incomplete = _INCOMPLETE.search(text)
+        if incomplete:
+            text, self._pending = text[:incomplete.start()], text[incomplete.start():]
+        else:
+            self._pending = ""
+        for match in _TOKEN.finditer(text):
+            token = match.group(0)
+            if match.group(3):
+                self._csi(match.group(1), match.group(2), match.group(3))
+            elif match.group(4) == "7":
+                self._saved = (self.row, self.column)
+            elif match.group(4) == "8":
+                self.row, self.column = self._saved
+            elif token == "\r":
+                self.column = 0
+                self._wrap = False
+            elif token == "\n":
+                self._line_feed()
+            elif token == "\b":
+                self.column = max(self.column - 1, 0)
+                self._wrap = False
+            elif token[0] >= " ":
+                self._print(token)
+
+    def _print(self, text):
+        for char in text:
+            if self._wrap:
+                self.column = 0
+                self._line_feed()
+            self.chars[self.row][self.column] = char
+            self.attrs[self.row][self.column] = self._sgr
+            if self.column == self.columns - 1:
+                self._wrap = True
+            else:
+                self.column += 1
+
+    def _line_feed(self):
+        self._wrap = False
+        if self.row == self.rows - 1:
+            self._delete_lines(0, 1)
+        else:
+            self.row += 1
+
+    def _insert_lines(self, row, count):
+        for i in range(min(count, self.rows - row)):
+            del self.chars[-1]
+            del self.attrs[-1]
+            self.chars.insert(row, [" "] * self.columns)
+            self.attrs.insert(row, [()] * self.columns)
+
+    def _delete_lines(self, row, count):
+        for i in range(min(count, self.rows - row)):
+            del self.chars[row]
+            del self.attrs[row]
+            self.chars.append([" "] * self.columns)
+            self.attrs.append([()] * self.columns)
+
+    def _csi(self, private, params, command):
+        if private:
+            if params == "25":
+                self.cursorVisible = (command == "h")
+            return
+        args = [int(p) if p else 0 for p in params.split(";")] if params else []
+        n = max(args[0], 1) if args else 1
+        self._wrap = False
+        if command == "A":
+            self.row = max(self.row - n, 0)
+        elif command == "B":
+            self.row = min(self.row + n, self.rows - 1)
+        elif command == "C":
+            self.column = min(self.column + n, self.columns - 1)
+        elif command == "D":
+            self.column = max(self.column - n, 0)
+        elif command == "G":
+            self.column = min(n, self.columns) - 1
+        elif command in "Hf":
+            row = args[0] if args else 1
+            column = args[1] if len(args) > 1 else 1
+            self.row = min(max(row, 1), self.rows) - 1
+            self.column = min(max(column, 1), self.columns) - 1
+        elif command == "K":
+            mode = args[0] if args else 0
+            start, end = dict([(0, (self.column, self.columns)), (1, (0, self.column + 1))]).get(mode, (0, self.columns))
+            for column in range(start, end):
+                self.chars[self.row][column] = " "
+                self.attrs[self.row][column] = ()
+        elif command == "J":
+            if (args[0] if args else 0) == 2:
+                self.chars = [[" "] * self.columns for i in range(self.rows)]
+                self.attrs = [[()] * self.columns for i in range(self.rows)]
+        elif command == "L":
+            self._insert_lines(self.row, n)
+            self.column = 0
+        elif command == "M":
+            self._delete_lines(self.row, n)
+            self.column = 0
+        elif command == "s":
+            self._saved = (self.row, self.column)
+        elif command == "u":
+            self.row, self.column = self._saved
+        elif command == "m":
+            self._set_sgr(args)
+
+    def _set_sgr(self, args):
+        sgr = list(self._sgr)
+        for arg in args or [0]:
+            if arg == 0:
+                sgr = []
+            else:
+                sgr.append(arg)
+        self._sgr = tuple(sgr)
+
+    def line(self, row):
+        return "".join(self.chars[row]).rstrip()
+
+    def lines(self):
+        """
+        The text of the screen, without trailing blank lines.
+        """
+        lines = [self.line(row) for row in range(self.rows)]
+        while lines and not lines[-1]:
+            lines.pop()
+        return lines
+
+class Frame(object):
+    """
+    What the menu wrote in response to a key: the time to the first and the
+    last byte and how much it wrote.
+    """
+    __slots__ = ("key", "first", "latency", "bytes", "writes")
+
+    def __init__(self, key, first, latency, bytes, writes):
+        self.key = key
+        self.first = first
+        self.latency = latency
+        self.bytes = bytes
+        self.writes = writes
+
+    def __repr__(self):
+        return "<Frame %r latency=%.1fms bytes=%d writes=%d>" % (self.key, self.latency * 1000, self.bytes, self.writes)
+
+class HeadlessTerminal(object):
+    """
+    Runs `target`, e.g. a function that shows a menu and returns its result,
+    in a child process attached to a pseudo-terminal of the given size.
+    The output counts as a stable frame once nothing was written for `settle`
+    seconds.
+    """
+    def __init__(self, target, rows=24, columns=80, settle=0.05, timeout=5.0):
+        self.target = target
+        self.screen = VirtualScreen(rows, columns)
+        self.settle = settle
+        self.timeout = timeout
+        self.frames = []
+        self._pid = None
+        self._fd = None
+        self._result = None
+
+    def start(self):
+        """
+        Start the child and wait for its first frame.
+        """
+        resultRead, resultWrite = os.pipe()
+        pid, fd = pty.fork()
+        if pid == 0:
+            os.close(resultRead)
+            self._run_child(resultWrite)
+        os.close(resultWrite)
+        self._pid = pid
+        self._fd = fd
+        self._result = resultRead
+        return self._read_frame(None, time.time())
+
+    def _run_child(self, resultWrite):
+        status = 1
+        try:
+            size = struct.pack("HHHH", self.screen.rows, self.screen.columns, 0, 0)
+            fcntl.ioctl(0, termios.TIOCSWINSZ, size)
+            # the parent's streams may have been replaced, e.g. by a test runner
+            sys.stdin = os.fdopen(0, "r")
+            sys.stdout = os.fdopen(1, "w")
+            # keys posted in the parent, e.g. on a resize, aren't for the child
+            keyboard._take_posted()
+            result = self.target()
+            os.write(resultWrite, pickle.dumps(result))
+            status = 0
+        except BaseException:
+            import traceback
+            traceback.print_exc(file=sys.stdout)
+            sys.stdout.flush()
+        finally:
+            os._exit(status)
+
+    def send(self, *keys):
+        """
+        Send keys, by the names keyboard uses or as text to type, in a single
+        write and wait for the frame they cause.
+        """
+        data = "".join(_key_sequence(key) for key in keys)
+        sent = time.time()
+        os.write(self._fd, data.encode("utf8"))
+        return self._read_frame(" ".join(keys), sent)
+
+    def _read_frame(self, key, start):
+        first = last = None
+        size = writes = 0
+        deadline = start + self.timeout
+        while True:
+            now = time.time()
+            if last is not None:
+                timeout = min(last + self.settle, deadline) - now
+            else:
+                timeout = deadline - now
+            if timeout <= 0 or not select.select([self._fd], [], [], timeout)[0]:
+                break
+            try:
+                data = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno == errno.EIO:
+                    # the child exited
+                    break
+                raise
+            if not data:
+                break
+            last = time.time()
+            if first is None:
+                first = last
+            size += len(data)
+            writes += 1
+            self.screen.feed(data.decode("utf8", "replace"))
+        if first is None:
+            first = last = start
+        frame = Frame(key, first - start, last - start, size, writes)
+        self.frames.append(frame)
+        return frame
+
+    def wait(self):
+        """
+        Wait for the child to exit and return what `target` returned.
+        """
+        data = []
+        while True:
+            chunk = os.read(self._result, 65536)
+            if not chunk:
+                break
+            data.append(chunk)
+        os.close(self._result)
+        # collect the last frame before the pty goes away
+        self._read_frame(None, time.time())
+        os.close(self._fd)
+        pid, status = os.waitpid(self._pid, 0)
+        if status != 0:
+            raise RuntimeError("menu exited with status %d" % status)
+        return pickle.loads(b"".join(data))
+
+    def stats(self):
+        """
+        Latency and size of the frames caused by keys.
+        """
+        frames = [f for f in self.frames if f.key is not None]
+        if not frames:
+            return {}
+        latencies = sorted(f.latency for f in frames)
+        return dict(
+            frames = len(frames),
+            latency_median = latencies[len(latencies)//2],
+            latency_max = latencies[-1],
+            bytes_per_frame = sum(f.bytes for f in frames) / float(len(frames)),
+        )
+
+def _sample_menu(count=100000):
+    import termenu
+    options = ["option %d" % i for i in range(count)]
+    return termenu.Termenu(options, height=20, plugins=[termenu.FilterPlugin()]).show()
+
+if __name__ == "__main__":
+    terminal = HeadlessTerminal(_sample_menu)
+    terminal.start()
+    for key in ["down"] * 30 + ["pageDown"] * 5 + list("12345") + ["backspace"] * 5:
+        terminal.send(key)
+    terminal.send("enter")
+    print(terminal.wait())
+    for name, value in sorted(terminal.stats().items()):
+        print("%s: %s" % (name, value))
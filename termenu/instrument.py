@@ -0,0 +1,101 @@
+import time
+
+# the most precise clock available
+clock = getattr(time, "perf_counter", time.time)
+
+class Histogram(object):
+    """
+    Counts of values in power of two buckets of `scale` units, e.g. 1e6 to
+    count seconds in microsecond buckets.
+    """
+    def __init__(self, scale=1):
+        self.scale = scale
+        self.buckets = {}
+        self.count = 0
+        self.total = 0
+        self.min = None
+        self.max = None
+
+    def add(self, value):
+        bucket = int(value * self.scale).bit_length()
+        self.buckets[bucket] = self.buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += value
+        if self.min is None or value < self.min:
+            self.min = value
+        if self.max is None or value > self.max:
+            self.max = value
+
+    def mean(self):
+        return self.total / self.count if self.count else None
+
+    def percentile(self, fraction):
+        """
+        An upper bound of the value below which `fraction` of the values fall.
+        """
+        if not self.count:
+            return None
+        seen = 0
+        for bucket in sorted(self.buckets):
+            seen += self.buckets[bucket]
+            if seen >= fraction * self.count:
+                return min((1 << bucket) / float(self.scale), self.max)
+        return self.max
+
+    def to_dict(self):
+        return dict(
+            count = self.count,
+            total = self.total,
+            min = self.min,
+            max = self.max,
+            mean = self.mean(),
+            p50 = self.percentile(0.5),
+            p99 = self.percentile(0.99),
+        )
+
+class MenuStats(object):
+    """
+    Live counters of a menu, see Termenu.enable_stats. Times are in seconds:
+
+        on_key          handling of a single key, including filtering
+        refilter        filtering the options after the query changed
+        print_menu      rendering a frame, without writing it out
+        write           writing out a frame
+        write_bytes     bytes written per frame
+        write_syscalls  os.write calls per frame
+
+    Rendering a row that didn't change since the last frame is a cache hit.
+    `callback`, if given, is called with the name and value of every sample.
+    """
+    TIMES = ("on_key", "refilter", "print_menu", "write")
+    COUNTS = ("write_bytes", "write_syscalls")
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        self.histograms = dict((name, Histogram(1e6)) for name in self.TIMES)
+        self.histograms.update((name, Histogram()) for name in self.COUNTS)
+        self.cacheHits = 0
+        self.cacheMisses = 0
+
+    def add(self, name, value):
+        self.histograms[name].add(value)
+        if self.callback:
+            self.callback(name, value)
+
+    def add_cache(self, hits, misses):
+        self.cacheHits += hits
+        self.cacheMisses += misses
+
+    def cache_hit_rate(self):
+        lines = self.cacheHits + self.cacheMisses
+        return self.cacheHits / float(lines) if lines else None
+
+    def _on_write(self, size, syscalls, start, end):
+        self.add("write", end - start)
+        self.add("write_bytes", size)
+        self.add("write_syscalls", syscalls)
+
+    def summary(self):
+        summary = dict((name, h.to_dict()) for name, h in self.histograms.items())
+        summary["cache_hit_rate"] = self.cache_hit_rate()
+        return summary
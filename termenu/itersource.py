@@ -0,0 +1,87 @@
+import itertools
+import threading
+from .menu import OptionSource
+
+class IteratorSource(OptionSource):
+    """
+    The options produced by an iterator, possibly an endless one, read on a
+    background thread `prefetch` rows ahead of the last row the menu asked
+    for. The menu grows as rows are read, a menu with a heartbeat also shows
+    rows that arrive while it's idle. Filtering only searches the rows read
+    so far.
+
+    If `reopen(index)` is given, it must return an iterator over the options
+    from `index` on. Then only about `keep` rows behind the last row asked
+    for are kept in memory and the others are read again when needed.
+    """
+    def __init__(self, iterable, prefetch=1000, reopen=None, keep=100000):
+        self.prefetch = prefetch
+        self.reopen = reopen
+        self.keep = keep
+        # the menu may forget option objects, they can be created again
+        self.cacheLimit = keep
+        self.done = False
+        self._rows = []
+        # the index of _rows[0], rows before it were dropped
+        self._base = 0
+        self._count = 0
+        self._wanted = prefetch
+        self._changed = threading.Condition()
+        # (index, rows) read again through reopen()
+        self._reread = (0, [])
+        thread = threading.Thread(target=self._read, args=(iter(iterable),))
+        thread.daemon = True
+        thread.start()
+        self.wait(prefetch)
+
+    def _read(self, iterator):
+        try:
+            for option in iterator:
+                with self._changed:
+                    self._rows.append(option)
+                    self._count += 1
+                    self._changed.notify_all()
+                    while self._count >= self._wanted:
+                        self._changed.wait()
+        finally:
+            with self._changed:
+                self.done = True
+                self._changed.notify_all()
+
+    def wait(self, count):
+        """
+        Wait until `count` rows were read or the iterator ended.
+        """
+        with self._changed:
+            self._wanted = max(self._wanted, count)
+            self._changed.notify_all()
+            while not self.done and self._count < count:
+                self._changed.wait()
+
+    def __len__(self):
+        return self._count
+
+    def __getitem__(self, index):
+        with self._changed:
+            if index + self.prefetch > self._wanted:
+                self._wanted = index + self.prefetch
+                self._changed.notify_all()
+            # rows that weren't read yet are waited for
+            while index >= self._count and not self.done:
+                self._changed.wait()
+            if self.reopen is not None and index - self._base > 2 * self.keep:
+                # drop rows far behind, in bulk so it's cheap
+                dropped = index - self.keep - self._base
+                del self._rows[:dropped]
+                self._base += dropped
+            if index >= self._base:
+                return self._rows[index - self._base]
+        return self._read_again(index)
+
+    def _read_again(self, index):
+        start, rows = self._reread
+        if not start <= index < start + len(rows):
+            start = max(index - self.prefetch // 2, 0)
+            rows = list(itertools.islice(self.reopen(start), self.prefetch))
+            self._reread = (start, rows)
+        return rows[index - start]
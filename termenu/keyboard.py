@@ -7,8 +7,16 @@ import fcntl
 import termios
 import select
 import errno
+import codecs
 
-STDIN = sys.stdin.fileno()
+try:
+    STDIN = sys.stdin.fileno()
+except (AttributeError, ValueError):
+    # stdin was replaced, e.g. while running tests
+    STDIN = 0
+
+# how long to wait for the rest of a key sequence after an Esc
+ESC_TIMEOUT = 0.05
 
 ANSI_SEQUENCES = dict(
     up = '\x1b[A',
@@ -43,9 +51,62 @@ KEY_NAMES.update({
     '\x7f' : 'backspace',
 })
 
+def _build_trie(sequences):
+    # nested dicts of the characters following the Esc, a None key marks
+    # the end of a sequence
+    trie = {}
+    for seq in sequences:
+        node = trie
+        for char in seq[1:]:
+            node = node.setdefault(char, {})
+        node[None] = KEY_NAMES[seq]
+    return trie
+
+SEQUENCE_TRIE = _build_trie(ANSI_SEQUENCES.values())
+
+# keys posted by signal handlers or other threads and a pipe that wakes up
+# keyboard_batches when there are some
+_posted = []
+_wakeup = None
+
+def post(key):
+    """
+    Make keyboard_batches yield `key` as if it was pressed, e.g. "resize"
+    from a SIGWINCH handler. Safe to call from signal handlers and threads.
+    """
+    _posted.append(key)
+    try:
+        os.write(_wakeup_fd(1), b"\0")
+    except OSError as e:
+        # the pipe is full, it's going to be read anyway
+        if e.errno != errno.EAGAIN:
+            raise
+
+def _wakeup_fd(end=0):
+    global _wakeup
+    if _wakeup is None:
+        _wakeup = os.pipe()
+        for fd in _wakeup:
+            fcntl.fcntl(fd, fcntl.F_SETFL, fcntl.fcntl(fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+    return _wakeup[end]
+
+def _take_posted():
+    try:
+        while os.read(_wakeup_fd(), 4096):
+            pass
+    except OSError as e:
+        if e.errno != errno.EAGAIN:
+            raise
+    count = len(_posted)
+    keys = _posted[:count]
+    # keys posted meanwhile wait for the next call
+    del _posted[:count]
+    return keys
+
 class RawTerminal(object):
     def __init__(self, blocking=True):
         self._blocking = blocking
+        self._decoder = codecs.getincrementaldecoder("utf-8")("replace")
 
     def open(self):
         # Set raw mode
@@ -65,7 +126,11 @@ class RawTerminal(object):
         fcntl.fcntl(STDIN, fcntl.F_SETFL, self._old)
 
     def get(self):
-        return os.read(sys.stdin.fileno(), 1).decode('ascii')
+        data = os.read(STDIN, 4096)
+        if not data:
+            raise EOFError()
+        # a read may end in the middle of a multibyte character
+        return self._decoder.decode(data)
 
     def wait(self):
         select.select([STDIN], [], [])
@@ -77,38 +142,82 @@ class RawTerminal(object):
     def __exit__(self, *args):
         self.close()
 
-def keyboard_listener(heartbeat=None):
+def _read_available(terminal):
+    # read everything that's waiting on a non-blocking terminal
+    chunks = []
+    while True:
+        try:
+            chunks.append(terminal.get())
+        except EOFError:
+            break
+        except OSError as e:
+            if e.errno == errno.EAGAIN:
+                break
+            raise
+    return "".join(chunks)
+
+def _decode(sequence, final=False):
+    """
+    Return the names of the keys in `sequence` and what's left of it when it
+    ends with an incomplete key sequence. If `final` is set, nothing is left
+    and a trailing incomplete sequence is taken as separate keys.
+    """
+    keys = []
+    i = 0
+    length = len(sequence)
+    while i < length:
+        # plain characters up to the next escape
+        start = sequence.find("\x1b", i)
+        if start < 0:
+            start = length
+        keys.extend([KEY_NAMES.get(char, char) for char in sequence[i:start]])
+        if start == length:
+            break
+
+        node = SEQUENCE_TRIE
+        end = start + 1
+        while end < length and sequence[end] in node:
+            node = node[sequence[end]]
+            end += 1
+            if None in node:
+                break
+        if None in node:
+            keys.append(node[None])
+            i = end
+        elif end == length and not final:
+            return keys, sequence[start:]
+        else:
+            keys.append("esc")
+            i = start + 1
+    return keys, ""
+
+def keyboard_batches(heartbeat=None):
+    """
+    Yield lists of all the keys that were available at once, or ["heartbeat"]
+    if no key was pressed for `heartbeat` seconds.
+    """
     with RawTerminal(blocking=False) as terminal:
-        # return keys
         sequence = ""
         while True:
-            yielded = False
-            # wait for keys to become available
-            select.select([STDIN], [], [], heartbeat)
-            # read all available keys
-            while True:
-                try:
-                    sequence = sequence + terminal.get()
-                except OSError as e:
-                    if e.errno == errno.EAGAIN:
-                        break
-            # handle ANSI key sequences
-            while sequence:
-                for seq in ANSI_SEQUENCES.values():
-                    if sequence[:len(seq)] == seq:
-                        yield KEY_NAMES[seq]
-                        yielded = True
-                        sequence = sequence[len(seq):]
-                        break
-                # handle normal keys
+            if sequence:
+                # give the rest of a split key sequence a moment to arrive,
+                # or it was just the Esc key
+                if select.select([STDIN], [], [], ESC_TIMEOUT)[0]:
+                    keys, sequence = _decode(sequence + _read_available(terminal))
                 else:
-                    for key in sequence:
-                        yield KEY_NAMES.get(key, key)
-                        yielded = True
-                    sequence = ""
-            if not yielded:
-                yield "heartbeat"
-    
+                    keys, sequence = _decode(sequence, final=True)
+            else:
+                select.select([STDIN, _wakeup_fd()], [], [], heartbeat)
+                keys, sequence = _decode(_read_available(terminal))
+                keys = _take_posted() + keys
+            if keys or not sequence:
+                yield keys or ["heartbeat"]
+
+def keyboard_listener(heartbeat=None):
+    for keys in keyboard_batches(heartbeat):
+        for key in keys:
+            yield key
+
 if __name__ == "__main__":
     for key in keyboard_listener(0.5):
         print(key)
@@ -1,6 +1,15 @@
 import io
+import re
 import sys
+import time
+import heapq
+import itertools
+import array
+import signal
+import threading
 from . import ansi
+from . import trace
+from .instrument import clock, MenuStats
 from . import version
 
 def show_menu(title, options, default=None, height=None, width=None, multiselect=False, precolored=False):
@@ -47,86 +56,504 @@ def pluggable(method):
     """
     Mark a class method as extendable with plugins.
     """
-    def wrapped(self, *args, **kwargs):
-        if hasattr(self, "_plugins"):
-            # call the last plugin, it may call the previous via self.parent.method
-            # creating a call call chain
-            return getattr(self._plugins[-1], method.__name__)(*args, **kwargs)
-        else:
-            return method(self, *args, **kwargs)
-    wrapped.original = method
-    return wrapped
+    method.pluggable = True
+    return method
+
+class _OriginalMethods(object):
+    # the end of every plugin chain, holds the host's own methods
+    pass
 
 def register_plugin(host, plugin):
     """
     Register a plugin with a host object. Some @pluggable methods in the host
     will have their behaviour altered by the plugin.
     """
-    class OriginalMethods(object):
-        def __getattr__(self, name):
-            return lambda *args, **kwargs: getattr(host, name).original(host, *args, **kwargs)
     if not hasattr(host, "_plugins"):
-        host._plugins = [OriginalMethods()]
+        host._plugins = [_OriginalMethods()]
     plugin.parent = host._plugins[-1]
     plugin.host = host
     host._plugins.append(plugin)
+    _compile_plugins(host)
+
+def _compile_plugins(host):
+    """
+    Resolve the call chain of every @pluggable method once, so that calling it
+    on the host or on a plugin's parent goes straight to the plugin that
+    implements it. Must be called again whenever the plugins change.
+    """
+    cls = type(host)
+    plugins = getattr(host, "_plugins", [])
+    tracer = getattr(host, "_tracer", None)
+    for name in dir(cls):
+        if not getattr(getattr(cls, name, None), "pluggable", False):
+            continue
+        method = getattr(cls, name).__get__(host, cls)
+        if tracer is not None:
+            method = tracer.wrap("%s.%s" % (cls.__name__, name), method)
+        if plugins:
+            setattr(plugins[0], name, method)
+        for plugin in plugins[1:]:
+            if hasattr(type(plugin), name):
+                method = getattr(type(plugin), name).__get__(plugin, type(plugin))
+                if tracer is not None:
+                    method = tracer.wrap("%s.%s" % (type(plugin).__name__, name), method)
+                    # calls through the parent of the next plugin find the
+                    # class attribute otherwise, which isn't traced
+                    plugin.__dict__[name] = method
+            else:
+                # instead of falling through Plugin.__getattr__
+                plugin.__dict__[name] = method
+        host.__dict__[name] = method
 
 class Plugin(object):
     def __getattr__(self, name):
         # allow calls to fall through to parent plugins if a method isn't defined
         return getattr(self.parent, name)
 
+class OptionSource(object):
+    """
+    Base class for virtual option lists. Termenu only creates option objects
+    for the items that are actually displayed or selected, so a source can be
+    arbitrarily large without slowing down the first paint.
+
+    Subclasses must implement __len__ and __getitem__, which returns a menu
+    option (a string or a (text, result) tuple), and may implement width_hint.
+    A source may set cacheLimit to let the menu forget all but about that many
+    of the option objects it created.
+    """
+    cacheLimit = None
+
+    def __len__(self):
+        raise NotImplementedError()
+
+    def __getitem__(self, index):
+        raise NotImplementedError()
+
+    def width_hint(self):
+        """
+        Return the length of the longest option, or None if unknown, in which
+        case the menu takes all the available width.
+        """
+        return None
+
+    def search(self, text, indices=None):
+        """
+        Return the ascending indices of the options whose lowercased text
+        contains `text`, only considering `indices` if given, or None to have
+        the menu check every option's text.
+        """
+        return None
+
+def _option_text(option):
+    if isinstance(option, tuple) and len(option) == 2:
+        option = option[0]
+    if not isinstance(option, str):
+        option = str(option)
+    return option
+
+class _LazyOptions(object):
+    """
+    Option list backed by an OptionSource that creates option objects on first
+    access. Views over a subset of the source (e.g. filter results) share the
+    created objects with the list they came from.
+    """
+    def __init__(self, source, factory, indices=None, cache=None):
+        self.source = source
+        self._factory = factory
+        self._indices = indices
+        self._cache = {} if cache is None else cache
+
+    def __len__(self):
+        if self._indices is None:
+            return len(self.source)
+        return len(self._indices)
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            return [self[i] for i in xrange(*index.indices(len(self)))]
+        if index < 0:
+            index += len(self)
+        if not 0 <= index < len(self):
+            raise IndexError("option index out of range")
+        if self._indices is not None:
+            index = self._indices[index]
+        option = self._cache.get(index)
+        if option is None:
+            option = self._cache[index] = self._factory(self.source[index], index)
+            limit = self.source.cacheLimit
+            if limit is not None and len(self._cache) > 2 * limit:
+                self._forget(index, limit)
+        return option
+
+    def _forget(self, index, limit):
+        # drop the options far from `index` that can be created again as they
+        # were, the selected ones and ones with attributes are kept
+        cache = self._cache
+        for i in [i for i in cache if abs(i - index) > limit // 2]:
+            option = cache[i]
+            if option._attrs is None and not option.selected:
+                del cache[i]
+
+    def __iter__(self):
+        for i in xrange(len(self)):
+            yield self[i]
+
+    def _source_indices(self):
+        if self._indices is None:
+            return xrange(len(self.source))
+        return self._indices
+
+    def texts(self, start=0):
+        """
+        Iterate over the option texts from position `start` on without
+        creating option objects.
+        """
+        for index in self._source_indices()[start:]:
+            option = self._cache.get(index)
+            yield option.text if option is not None else _option_text(self.source[index])
+
+    def results(self, start=0):
+        """
+        Iterate over the option results from position `start` on without
+        creating option objects.
+        """
+        for index in self._source_indices()[start:]:
+            option = self._cache.get(index)
+            if option is not None:
+                yield option.result
+            else:
+                option = self.source[index]
+                yield option[1] if isinstance(option, tuple) and len(option) == 2 else option
+
+    def entries(self):
+        """
+        Iterate over (text, option) pairs, option is None if it wasn't created.
+        """
+        for index, text in zip(self._source_indices(), self.texts()):
+            yield text, self._cache.get(index)
+
+    def take(self, positions):
+        """
+        Return a view of the options at the given positions of this list.
+        """
+        if self._indices is not None:
+            positions = [self._indices[i] for i in positions]
+        return _LazyOptions(self.source, self._factory, array.array("L", positions), self._cache)
+
+    def search(self, text):
+        """
+        Return a view of the options whose text contains `text` if the source
+        can search itself, None otherwise.
+        """
+        if any(o.get_attr("showAlways") for o in self._cache.values()):
+            return None
+        indices = self.source.search(text, self._indices)
+        if indices is None:
+            return None
+        return _LazyOptions(self.source, self._factory, indices, self._cache)
+
+    def where(self, predicate):
+        """
+        Return a view of the options for which predicate(text, option) is true.
+        `option` is None for options that weren't created yet.
+        """
+        indices = array.array("L")
+        for index, text in zip(self._source_indices(), self.texts()):
+            if predicate(text, self._cache.get(index)):
+                indices.append(index)
+        return _LazyOptions(self.source, self._factory, indices, self._cache)
+
+def _option_texts(options, start=0):
+    if isinstance(options, _LazyOptions):
+        return options.texts(start)
+    return (o.text for o in options[start:])
+
+def _option_results(options, start=0):
+    if isinstance(options, _LazyOptions):
+        return options.results(start)
+    return (o.result for o in options[start:])
+
+def _option_entries(options):
+    if isinstance(options, _LazyOptions):
+        return options.entries()
+    return ((o.text, o) for o in options)
+
+class _OptionIndex(object):
+    """
+    Maps the text or the result of options to the index of the first option
+    that has it, and to the indices of the others in a separate dict, as
+    duplicates are rare. Built on the first lookup and extended with the
+    options added since. Unhashable results can't be looked up.
+    """
+    def __init__(self, options, attribute):
+        self.options = options
+        self.attribute = attribute
+        self._map = {}
+        self._duplicates = {}
+        self._count = 0
+
+    def get(self, value):
+        if self._count < len(self.options):
+            self._update()
+        try:
+            return self._map.get(value)
+        except TypeError:
+            return None
+
+    def get_all(self, value):
+        first = self.get(value)
+        if first is None:
+            return []
+        return [first] + self._duplicates.get(value, [])
+
+    def _update(self):
+        start = self._count
+        end = len(self.options)
+        # only the options added since the last update are read
+        if self.attribute == "text":
+            values = _option_texts(self.options, start)
+        else:
+            values = _option_results(self.options, start)
+        values = itertools.islice(values, end - start)
+        setdefault = self._map.setdefault
+        for index, value in enumerate(values, start):
+            try:
+                first = setdefault(value, index)
+            except TypeError:
+                continue
+            if first != index:
+                self._duplicates.setdefault(value, []).append(index)
+        self._count = end
+
+class _Attrs(dict):
+    """
+    Attribute dict handed out for options that don't have one yet. It attaches
+    itself to its option on the first write, so options without attributes
+    don't pay for an empty dict each.
+    """
+    __slots__ = ("_owner",)
+
+    def __init__(self, owner):
+        dict.__init__(self)
+        self._owner = owner
+
+    def _attach(self):
+        if self._owner is not None:
+            self._owner._attrs = self
+            self._owner = None
+
+    def __setitem__(self, key, value):
+        self._attach()
+        dict.__setitem__(self, key, value)
+
+    def setdefault(self, key, default=None):
+        self._attach()
+        return dict.setdefault(self, key, default)
+
+    def update(self, *args, **kwargs):
+        self._attach()
+        dict.update(self, *args, **kwargs)
+
 class Termenu(object):
     class _Option(object):
-        def __init__(self, option, **attrs):
+        # menus may hold millions of options, keep them small
+        __slots__ = ("text", "result", "index", "_attrs")
+
+        # every menu subclasses _Option with its own dict of the selected
+        # options by index, None for options of a lazy list that were
+        # selected before they were created
+        _selection = None
+
+        def __init__(self, option, index=None, **attrs):
             if isinstance(option, tuple) and len(option) == 2:
-                self.text, self.result = option
+                self.result = option[1]
+            else:
+                self.result = option
+            self.text = _option_text(option)
+            self.index = index
+            self._attrs = attrs or None
+
+        @property
+        def selected(self):
+            return self.index in self._selection
+
+        @selected.setter
+        def selected(self, selected):
+            if selected:
+                self._selection[self.index] = self
             else:
-                self.text = self.result = option
-            if not isinstance(self.text, str):
-                self.text = str(self.text)
-            self.selected = False
-            self.attrs = attrs
+                self._selection.pop(self.index, None)
+
+        @property
+        def attrs(self):
+            if self._attrs is None:
+                return _Attrs(self)
+            return self._attrs
+
+        @attrs.setter
+        def attrs(self, attrs):
+            self._attrs = attrs
+
+        def get_attr(self, name, default=None):
+            # cheaper than attrs.get() for options without attributes
+            if self._attrs is None:
+                return default
+            return self._attrs.get(name, default)
 
     def __init__(self, options, default=None, height=None, width=None, multiselect=True, heartbeat=None, plugins=None):
+        self._tracer = trace.from_environment()
+        self._selection = {}
+        self._Option = type("_Option", (self._Option,), dict(__slots__=(), _selection=self._selection))
+        self._nextIndex = 0
         for plugin in plugins or []:
             register_plugin(self, plugin)
+        if self._tracer is not None and not plugins:
+            # trace the methods of a menu without plugins too
+            _compile_plugins(self)
+        self._addingOptions = False
         self.options = self._make_option_objects(options)
         self.height = min(height or 10, len(self.options))
+        self._width = width
+        self._widest = None
         self.width = self._compute_width(width, self.options)
         self.multiselect = multiselect
         self.cursor = 0
         self.scroll = 0
         self._heartbeat = heartbeat
+        self._previousResizeHandler = None
+        # the rows are cleared in the next frame, see _on_resize
+        self._clearPending = False
         self._aborted = False
+        self._stats = None
         self._lineCache = {}
+        self._cacheScroll = None
+        self._cacheOptions = None
         self._set_default(default)
 
     def get_result(self):
         if self._aborted:
             return [] if self.multiselect else None
         else:
-            selected = [o.result for o in self.options if o.selected]
+            selected = [o.result for o in self._selected_options()]
             if not selected:
-                selected.append(self._get_active_option().result)
+                active = self._get_active_option()
+                if active is None:
+                    return [] if self.multiselect else None
+                selected.append(active.result)
             return selected if self.multiselect else selected[0]
 
+    def add_options(self, options):
+        """
+        Add options to the end of the menu, possibly while it's being shown.
+        Must be called from the thread running show(), e.g. from a plugin's
+        _on_heartbeat. The menu's height and width are not changed.
+        A menu of an OptionSource can't be added to, the source grows instead.
+        """
+        if isinstance(self._textIndex.options, _LazyOptions):
+            raise TypeError("can't add options to a menu of an OptionSource")
+        # let plugins tell new options from a complete set of options
+        self._addingOptions = True
+        try:
+            objects = self._make_option_objects(options)
+        finally:
+            self._addingOptions = False
+        self._add_options(objects)
+
+    def enable_stats(self, callback=None):
+        """
+        Start collecting timings of key handling, filtering and rendering,
+        the size of the writes to the terminal and the rate of rows that
+        didn't have to be redrawn. Returns a MenuStats object with the
+        histograms, `callback` is called with every sample.
+        """
+        self._stats = MenuStats(callback)
+        return self._stats
+
+    def disable_stats(self):
+        self._stats = None
+
+    def _measuring(self):
+        # only the writes of this menu count in its stats, not those of
+        # menus shown at the same time or from within it
+        return ansi.observing(self._stats._on_write if self._stats is not None else None)
+
     @pluggable
     def show(self):
         from termenu import keyboard
-        self._print_menu()
-        ansi.save_position()
-        ansi.hide_cursor()
+        with self._measuring():
+            self._show_start()
         try:
-            for key in keyboard.keyboard_listener(self._heartbeat):
-                stop = self._on_key(key)
+            for keys in self._traced_batches(keyboard.keyboard_batches(self._heartbeat)):
+                with self._measuring():
+                    stop = self._show_keys(keys)
                 if stop:
                     return self.get_result()
-                self._goto_top()
-                self._print_menu()
         finally:
+            with self._measuring():
+                self._show_end()
+
+    @pluggable
+    def show_async(self):
+        """
+        Like show(), but returns an awaitable that reads the keyboard through
+        the running asyncio event loop instead of blocking it.
+        """
+        from termenu import aio
+        return aio.show(self)
+
+    def _traced_batches(self, batches):
+        if self._tracer is None:
+            return batches
+        return self._tracer.iterate("read keys", batches)
+
+    def _record(self, name, start, **args):
+        # report a span that started at `start` to the stats and the tracer
+        end = clock()
+        if self._stats is not None:
+            self._stats.add(name, end - start)
+        if self._tracer is not None:
+            self._tracer.complete(name, start, end, args)
+
+    @pluggable
+    def _show_start(self):
+        self._previousResizeHandler = _watch_resize()
+        with ansi.buffered():
+            start = (self._stats or self._tracer) and clock()
+            self._print_menu()
+            if start:
+                self._record("print_menu", start)
+            ansi.save_position()
+            ansi.hide_cursor()
+
+    def _show_keys(self, keys):
+        # apply all the keys read at once and then draw a single frame
+        idle = keys == ["heartbeat"]
+        if idle:
+            options, state = self.options, self._view_state()
+        stop = self._on_keys(keys)
+        if stop:
+            return stop
+        if idle and self.options is options and self._view_state() == state:
+            # nothing visible changed while idle
+            return
+        with ansi.buffered():
+            start = (self._stats or self._tracer) and clock()
+            if self._clearPending:
+                self._clearPending = False
+                self._clear_menu()
+            self._goto_top()
+            self._print_menu()
+            if start:
+                self._record("print_menu", start)
+
+    @pluggable
+    def _show_end(self):
+        _unwatch_resize(self._previousResizeHandler)
+        with ansi.buffered():
             self._clear_menu()
             ansi.show_cursor()
+        if self._tracer is not None:
+            self._tracer.save()
 
     @pluggable
     def _goto_top(self):
@@ -135,7 +562,25 @@ class Termenu(object):
 
     @pluggable
     def _make_option_objects(self, options):
-        return [self._Option(o) for o in options]
+        if isinstance(options, OptionSource):
+            objects = _LazyOptions(options, self._Option)
+        elif self._addingOptions:
+            objects = [self._Option(o, i) for i, o in enumerate(options, self._nextIndex)]
+            self._nextIndex += len(objects)
+            return objects
+        else:
+            objects = [self._Option(o, i) for i, o in enumerate(options)]
+            self._nextIndex = len(objects)
+        # a new set of options, indexed by text and result on first lookup
+        self._selection.clear()
+        self._textIndex = _OptionIndex(objects, "text")
+        self._resultIndex = _OptionIndex(objects, "result")
+        self._positions = None
+        return objects
+
+    @pluggable
+    def _add_options(self, options):
+        self.options.extend(options)
 
     @pluggable
     def _set_default(self, default):
@@ -143,23 +588,25 @@ class Termenu(object):
         if isinstance(default, list) and default:
             if not self.multiselect:
                 raise ValueError("multiple defaults passed, but multiselect is False")
-            for option in self.options:
-                if option.text in default:
-                    option.selected = True
+            self.select_by_text(default)
             default = default[0]
 
         # handle default active option
         index = self._get_index(default)
         if index is not None:
-            if index < self.height:
-                self.cursor = index % self.height
-                self.scroll = 0
-            elif index + self.height < len(self.options) - 1:
-                self.cursor = 0
-                self.scroll = index
-            else:
-                self.cursor = index % self.height + 1
-                self.scroll = len(self.options) - self.height
+            self._scroll_to(index)
+
+    def _scroll_to(self, index):
+        # make the option at `index` of the options shown the active one
+        if index < self.height:
+            self.cursor = index % self.height
+            self.scroll = 0
+        elif index + self.height <= len(self.options):
+            self.cursor = 0
+            self.scroll = index
+        else:
+            self.scroll = len(self.options) - self.height
+            self.cursor = index - self.scroll
 
     def _compute_width(self, width, options):
         termwidth = get_terminal_size()[0]
@@ -169,15 +616,43 @@ class Termenu(object):
         else:
             maxwidth = termwidth
         maxwidth -= decorations
-        maxoption = max(len(o.text) for o in options)
+        if not options:
+            return maxwidth
+        if isinstance(options, _LazyOptions):
+            maxoption = options.source.width_hint()
+            if maxoption is None:
+                return maxwidth
+        else:
+            maxoption = self._widest_option(options)
         return min(maxoption, maxwidth)
 
+    def _widest_option(self, options):
+        # remembered until the list changes, so resizing doesn't measure
+        # every option again
+        widest = self._widest
+        if widest is None or widest[0] is not options or widest[1] != len(options):
+            widest = self._widest = (options, len(options), max(len(o.text) for o in options))
+        return widest[2]
+
     def _get_index(self, s):
-        matches = [i for i, o in enumerate(self.options) if o.text == s]
-        if matches:
-            return matches[0]
-        else:
+        if s is None:
             return None
+        return self._position(self._textIndex.get(s))
+
+    def _position(self, index):
+        # the position among the options shown of the option with the given
+        # index, None if it isn't shown, e.g. because it doesn't match a filter
+        options = self.options
+        if index is None or options is self._textIndex.options:
+            return index
+        positions = self._positions
+        if positions is None or positions[0] is not options or positions[1] != len(options):
+            if isinstance(options, _LazyOptions):
+                indices = options._source_indices()
+            else:
+                indices = (o.index for o in options)
+            positions = self._positions = (options, len(options), dict(zip(indices, xrange(len(options)))))
+        return positions[2].get(index)
 
     def _get_active_option(self):
         return self.options[self.scroll+self.cursor] if self.options else None
@@ -191,6 +666,16 @@ class Termenu(object):
             options.append(("(%s)" if i == self.cursor else "%s") % option.text)
         return " ".join(options)
 
+    @pluggable
+    def _on_keys(self, keys):
+        for key in keys:
+            start = (self._stats or self._tracer) and clock()
+            stop = self._on_key(key)
+            if start:
+                self._record("on_key", start, key=key)
+            if stop:
+                return stop
+
     @pluggable
     def _on_key(self, key):
         func = "_on_" + key
@@ -201,6 +686,21 @@ class Termenu(object):
     def _on_heartbeat(self):
         pass
 
+    def _on_resize(self):
+        # the terminal reflowed the rows if it got narrower, clear them and
+        # draw everything again at the new width, in the same frame so the
+        # terminal never shows the cleared rows
+        self._clearPending = True
+        self._clear_cache()
+        self.width = self._compute_width(self._width, self._textIndex.options)
+
+    @pluggable
+    def _view_state(self):
+        # what the rows depend on besides the options list, a heartbeat that
+        # doesn't change it doesn't redraw the menu. Plugins that draw
+        # something else that changes on heartbeats add it.
+        return (self.scroll, self.cursor, min(len(self.options), self.scroll + self.height + 1))
+
     def _on_down(self):
         height = min(self.height, len(self.options))
         if self.cursor < height - 1:
@@ -237,8 +737,117 @@ class Termenu(object):
         self.scroll = 0
 
     def _on_end(self):
-        self.scroll = len(self.options) - self.height
-        self.cursor = self.height - 1
+        height = min(self.height, len(self.options))
+        self.scroll = len(self.options) - height
+        self.cursor = height - 1
+
+    def _selected_options(self):
+        # in the order of the options, creating the ones that were selected
+        # in a lazy list without being created
+        selection = self._selection
+        options = self._textIndex.options
+        selected = []
+        for index in sorted(selection):
+            option = selection[index]
+            if option is None:
+                option = selection[index] = options[index]
+            selected.append(option)
+        return selected
+
+    def select_all(self):
+        """
+        Select all the options that are shown, e.g. all matches of a filter,
+        except those that are always shown, like group headers.
+        """
+        if not self.multiselect:
+            return
+        options = self.options
+        if isinstance(options, _LazyOptions):
+            # without creating the options
+            self._selection.update(dict.fromkeys(self._selectable_indices(options)))
+        else:
+            self._selection.update((o.index, o) for o in options if not o.get_attr("showAlways"))
+
+    def invert_selection(self):
+        """
+        Select the options that are shown and not selected and unselect the
+        ones that are, except those that are always shown.
+        """
+        if not self.multiselect:
+            return
+        selection = self._selection
+        options = self.options
+        if isinstance(options, _LazyOptions):
+            shown = set(self._selectable_indices(options))
+            unselect = shown.intersection(selection)
+            for index in unselect:
+                del selection[index]
+            selection.update(dict.fromkeys(shown.difference(unselect)))
+            return
+        for option in options:
+            if option.get_attr("showAlways"):
+                continue
+            if option.index in selection:
+                del selection[option.index]
+            else:
+                selection[option.index] = option
+
+    def _selectable_indices(self, options):
+        # only created options can have attributes
+        always = set(i for i, o in options._cache.items() if o.get_attr("showAlways"))
+        indices = options._source_indices()
+        if not always:
+            return indices
+        return (i for i in indices if i not in always)
+
+    def clear_selection(self):
+        self._selection.clear()
+
+    def select_by_text(self, texts):
+        """
+        Select the options with any of the given texts, whether they're
+        shown or not. Returns the number of options selected.
+        """
+        return self._select_by(self._textIndex, texts)
+
+    def select_by_result(self, results):
+        """
+        Select the options with any of the given results, whether they're
+        shown or not. Returns the number of options selected.
+        """
+        return self._select_by(self._resultIndex, results)
+
+    def _select_by(self, optionIndex, values):
+        if not self.multiselect:
+            raise ValueError("multiselect is False")
+        options = optionIndex.options
+        found = 0
+        for value in values:
+            for index in optionIndex.get_all(value):
+                self._selection[index] = options[index]
+                found += 1
+        return found
+
+    def jump_to_text(self, text):
+        """
+        Make the first option with the given text the active one. Returns
+        False if there is no such option or it isn't shown.
+        """
+        return self._jump_to(self._textIndex.get(text))
+
+    def jump_to_result(self, result):
+        """
+        Make the first option with the given result the active one. Returns
+        False if there is no such option or it isn't shown.
+        """
+        return self._jump_to(self._resultIndex.get(result))
+
+    def _jump_to(self, index):
+        position = self._position(index)
+        if position is None:
+            return False
+        self._scroll_to(position)
+        return True
 
     @pluggable
     def _on_space(self):
@@ -258,6 +867,34 @@ class Termenu(object):
 
     def _clear_cache(self):
         self._lineCache = {}
+        self._cacheScroll = None
+
+    def _scroll_lines(self):
+        """
+        If the window only scrolled since the last frame, shift the lines that
+        are still visible on the terminal instead of repainting them, leaving
+        only the newly exposed lines (and changed decorations) to be drawn.
+        """
+        if self._cacheScroll is None or self.options is not self._cacheOptions:
+            return
+        offset = self.scroll - self._cacheScroll
+        if offset == 0 or abs(offset) >= self.height or len(self.options) < self.height:
+            return
+        # delete lines on one side of the menu and insert blank lines on the other,
+        # the order makes sure lines below the menu end up where they were
+        if offset > 0:
+            ansi.delete_lines(offset)
+            ansi.down(self.height - offset)
+            ansi.insert_lines(offset)
+            ansi.up(self.height - offset)
+        else:
+            ansi.down(self.height + offset)
+            ansi.delete_lines(-offset)
+            ansi.up(self.height + offset)
+            ansi.insert_lines(-offset)
+        ansi.write("\r")
+        self._lineCache = dict((index - offset, line) for index, line in self._lineCache.items()
+                               if 0 <= index - offset < self.height)
 
     @pluggable
     def _clear_menu(self):
@@ -270,15 +907,32 @@ class Termenu(object):
     @pluggable
     def _print_menu(self):
         ansi.write("\r")
-        for index, option in enumerate(self._get_window()):
+        self._scroll_lines()
+        self._cacheScroll = self.scroll
+        self._cacheOptions = self.options
+        window = self._get_window()
+        hits = 0
+        for index, option in enumerate(window):
             option = option.text
             option = self._adjust_width(option)
             option = self._decorate(option, **self._decorate_flags(index))
             if self._lineCache.get(index) == option:
                 ansi.down()
+                hits += 1
             else:
                 ansi.write(option + "\n")
                 self._lineCache[index] = option
+        # blank out the rest of the menu if there are less options than rows
+        for index in xrange(len(window), self.height):
+            if self._lineCache.get(index) == "":
+                ansi.down()
+                hits += 1
+            else:
+                ansi.clear_eol()
+                ansi.write("\n")
+                self._lineCache[index] = ""
+        if self._stats is not None:
+            self._stats.add_cache(hits, max(self.height, len(window)) - hits)
 
     @pluggable
     def _adjust_width(self, option):
@@ -329,62 +983,226 @@ class Termenu(object):
 
         return option
 
+class _FilterResult(object):
+    __slots__ = ("text", "matches", "options", "cursor")
+
+    def __init__(self, text, matches):
+        self.text = text
+        # all matching options in their original order
+        self.matches = matches
+        # the options shown for this query, None until first shown
+        self.options = None
+        self.cursor = 0
+
 class FilterPlugin(Plugin):
-    def __init__(self):
+    def __init__(self, fuzzy=False, limit=1000):
         self.text = None
+        # while a batch of keys is handled query edits only mark the filter
+        # as dirty, so pasting or typing ahead refilters once
+        self._batching = False
+        self._dirty = False
+        # fuzzy filtering ranks the best `limit` matches instead of showing
+        # substring matches in their original order
+        self.fuzzy = fuzzy
+        self.limit = limit
+        # results for every prefix of the current query, narrowing queries only
+        # search the previous matches and backspace/esc just pop back to an
+        # earlier entry
+        self._results = []
 
     def _make_option_objects(self, options):
         objects = self.parent._make_option_objects(options)
-        self._allOptions = objects[:]
+        if not self.host._addingOptions:
+            # host.options is only ever replaced, never modified, so share the list
+            self._allOptions = objects
+            self._results = []
         return objects
 
+    def _add_options(self, options):
+        # extend the unfiltered options and the matches of every cached query,
+        # the host's list is extended by the base implementation
+        hostOptions = options
+        lists = [(self._allOptions, options)]
+        for result in self._results:
+            options = self._filter(options, result.text)
+            lists.append((result.matches, options))
+        extended = []
+        for matches, added in lists:
+            if matches is self.host.options:
+                hostOptions = added
+            elif not any(matches is e for e in extended):
+                matches.extend(added)
+                extended.append(matches)
+
+        if self.fuzzy and self._results and self._results[-1].text:
+            # rankings are stale, rank the shown query again and the rest when
+            # they're shown again
+            for result in self._results:
+                if result.options is not result.matches:
+                    result.options = None
+            result = self._results[-1]
+            result.options = self._rank(result.matches, result.text)[1]
+            self.host.options = result.options
+            self.host._clear_cache()
+            self.host.cursor = min(self.host.cursor, max(len(result.options) - self.host.scroll - 1, 0))
+            hostOptions = []
+        return self.parent._add_options(hostOptions)
+
+    def _on_keys(self, keys):
+        self._batching = True
+        try:
+            return self.parent._on_keys(keys)
+        finally:
+            self._batching = False
+            if self._dirty:
+                self._refilter()
+
     def _on_key(self, key):
         prevent = False
         if len(key) == 1 and 32 < ord(key) <= 127:
             if not self.text:
                 self.text = []
             self.text.append(key)
-            self._refilter()
+            self._text_changed()
         elif self.text and key == "backspace":
             del self.text[-1]
-            self._refilter()
+            self._text_changed()
         elif self.text is not None and key == "esc":
             self.text = None
             prevent = True
-            self._refilter()
-        elif not self.host.options and key == "space":
-            prevent = True
+            self._text_changed()
+        else:
+            if self._dirty:
+                # other keys need the results of the edits before them
+                self._refilter()
+            if not self.host.options and key == "space":
+                prevent = True
 
         if not prevent:
             return self.parent._on_key(key)
 
+    def _text_changed(self):
+        if self._batching:
+            self._dirty = True
+        else:
+            self._refilter()
+
     def _print_menu(self):
         self.parent._print_menu()
 
-        for i in xrange(0, self.host.height - len(self.host.options)):
-            ansi.clear_eol()
-            ansi.write("\n")
         if self.text is not None:
             ansi.write("/" + "".join(self.text))
             ansi.show_cursor()
         ansi.clear_eol()
 
     def _refilter(self):
+        start = (self.host._stats or self.host._tracer) and clock()
+        self._dirty = False
         self.host._clear_cache()
-        self.host.options = []
         text = "".join(self.text or []).lower()
-        # filter the matching options
-        for option in self._allOptions:
-            if text in option.text.lower() or option.attrs.get("showAlways"):
-                self.host.options.append(option)
-        # select the first matching element (showAlways elements might not match)
-        self.host.scroll = 0
-        self.host.cursor = 0
-        for i, option in enumerate(self.host.options):
-            if not option.attrs.get("showAlways") and text in option.text.lower():
-                self.host.cursor = i
-                break
 
+        # drop results of queries that the current query doesn't extend
+        while self._results and not text.startswith(self._results[-1].text):
+            self._results.pop()
+
+        if self._results and self._results[-1].text == text:
+            result = self._results[-1]
+        else:
+            candidates = self._results[-1].matches if self._results else self._allOptions
+            result = self._match(candidates, text)
+            self._results.append(result)
+
+        if result.options is None:
+            if self.fuzzy and text:
+                result.options = self._rank(result.matches, text)[1]
+            else:
+                result.options = result.matches
+            result.cursor = self._first_match(result.options)
+
+        self.host.options = result.options
+        self.host.scroll = 0
+        self.host.cursor = result.cursor
+        if start:
+            self.host._record("refilter", start, query=text)
+
+    def _match(self, candidates, text):
+        if self.fuzzy and text:
+            # match and rank in one pass
+            matches, options = self._rank(candidates, text)
+            result = _FilterResult(text, matches)
+            result.options = options
+            result.cursor = self._first_match(options)
+            return result
+        return _FilterResult(text, self._filter(candidates, text))
+
+    def _first_match(self, options):
+        # showAlways elements might not match
+        for i, option in enumerate(options):
+            if not option.get_attr("showAlways"):
+                return i
+        return 0
+
+    def _filter(self, options, text):
+        if not text:
+            return options
+        if self.fuzzy:
+            # the characters of the query in order, anything but the next
+            # character in between so the regex never backtracks
+            pattern = "".join(re.escape(c) + "[^%s]*" % re.escape(n) for c, n in zip(text, text[1:]))
+            pattern = re.compile(pattern + re.escape(text[-1]), re.DOTALL)
+            match = lambda t: pattern.search(t.lower())
+        else:
+            match = lambda t: text in t.lower()
+        if isinstance(options, _LazyOptions):
+            found = None if self.fuzzy else options.search(text)
+            if found is not None:
+                return found
+            return options.where(lambda t, o: match(t) or (o is not None and o.get_attr("showAlways")))
+        if not self.fuzzy:
+            # inlined for speed, this is the common case
+            return [o for o in options if text in o.text.lower() or o.get_attr("showAlways")]
+        return [o for o in options if match(o.text) or o.get_attr("showAlways")]
+
+    def _rank(self, candidates, text):
+        """
+        Find the fuzzy matches among the candidates and order the best `limit`
+        of them by score. showAlways options (e.g. group headers) are always
+        included and stay in place, the matches between them are ranked
+        within their group. Returns (matches, ranked options).
+        """
+        positions = []
+        headers = []
+        # bounded min-heap of the best matches so far
+        best = []
+        for i, (t, option) in enumerate(_option_entries(candidates)):
+            if option is not None and option.get_attr("showAlways"):
+                headers.append(len(positions))
+                positions.append(i)
+                continue
+            score = fuzzy_score(text, t)
+            if score is None:
+                continue
+            if len(best) < self.limit:
+                # prefer shorter and then earlier options on equal scores
+                heapq.heappush(best, (score, -len(t), -len(positions), len(headers)))
+            elif score >= best[0][0]:
+                heapq.heappushpop(best, (score, -len(t), -len(positions), len(headers)))
+            positions.append(i)
+        best.sort(reverse=True)
+
+        groups = [[] for i in xrange(len(headers) + 1)]
+        for score, negLength, negIndex, group in best:
+            groups[group].append(-negIndex)
+        order = groups[0]
+        for header, group in zip(headers, groups[1:]):
+            order.append(header)
+            order.extend(group)
+
+        if isinstance(candidates, _LazyOptions):
+            matches = candidates.take(positions)
+            return matches, matches.take(order)
+        matches = [candidates[i] for i in positions]
+        return matches, [matches[i] for i in order]
 
 class OptionGroup(object):
     def __init__(self, header, options):
@@ -398,7 +1216,7 @@ class OptionGroupPlugin(Plugin):
         else:
             self.host.scroll = 0
             for i, option in enumerate(self.host.options):
-                if not option.attrs.get("header"):
+                if not option.get_attr("header"):
                     self.host.cursor = i
                     break
 
@@ -422,7 +1240,7 @@ class OptionGroupPlugin(Plugin):
 
     def _on_enter(self):
         # can't select a header
-        if self.host._get_active_option().attrs.get("header"):
+        if self.host._get_active_option().get_attr("header"):
             if self.host.multiselect and self.host.get_result() != [None]:
                 return True
             else:
@@ -432,14 +1250,14 @@ class OptionGroupPlugin(Plugin):
             return self.parent._on_enter()
 
     def _on_space(self):
-        if self.host._get_active_option().attrs.get("header"):
+        if self.host._get_active_option().get_attr("header"):
             self.host._on_down()
         else:
             self.parent._on_space()
 
     def _decorate_flags(self, index):
         flags = self.parent._decorate_flags(index)
-        flags["header"] = self.host.options[self.host.scroll+index].attrs.get("header")
+        flags["header"] = self.host.options[self.host.scroll+index].get_attr("header")
         return flags
 
     def _decorate(self, option, **flags):
@@ -458,12 +1276,25 @@ class OptionGroupPlugin(Plugin):
 class PrecoloredPlugin(Plugin):
     def _make_option_objects(self, options):
         options = self.parent._make_option_objects(options)
+        if isinstance(options, _LazyOptions):
+            # color the options of a source as they're created
+            factory = options._factory
+            def precolored(option, index):
+                return self._precolor(factory(option, index))
+            options._factory = precolored
+            for option in options._cache.values():
+                self._precolor(option)
+            return options
         for option in options:
-            option.text = ansi.ansistr(option.text)
-            if isinstance(option.result, str):
-                option.result = ansi.decolorize(option.result)
+            self._precolor(option)
         return options
 
+    def _precolor(self, option):
+        option.text = ansi.ansistr(option.text)
+        if isinstance(option.result, str):
+            option.result = ansi.decolorize(option.result)
+        return option
+
     def _decorate(self, option, **flags):
         active = flags.get("active", False)
         selected = flags.get("selected", False)
@@ -502,6 +1333,77 @@ class TitlePlugin(Plugin):
         ansi.up()
         ansi.clear_eol()
 
+class LiveOptions(object):
+    """
+    Options that keep arriving while a menu is shown, e.g. over the network
+    or from a slow command. Producers push() batches of options from any
+    thread and a LivePlugin adds them to the menu between keys.
+    """
+    def __init__(self, options=()):
+        self.done = False
+        self._pending = list(options)
+        self._changed = threading.Condition()
+
+    def push(self, options):
+        with self._changed:
+            self._pending.extend(options)
+            self._changed.notify_all()
+
+    def close(self):
+        """
+        Tell the menu no more options are coming.
+        """
+        with self._changed:
+            self.done = True
+            self._changed.notify_all()
+
+    def wait(self, count, timeout=None):
+        """
+        Wait until at least `count` options are pending, no more are coming
+        or `timeout` seconds passed.
+        """
+        deadline = None if timeout is None else time.time() + timeout
+        with self._changed:
+            while not self.done and len(self._pending) < count:
+                if deadline is None:
+                    self._changed.wait()
+                    continue
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                self._changed.wait(remaining)
+
+    def take(self):
+        """
+        Return the options pushed since the last call.
+        """
+        with self._changed:
+            options, self._pending = self._pending, []
+        return options
+
+class LivePlugin(Plugin):
+    """
+    Adds the options pushed to a LiveOptions to the menu before every batch of
+    keys and every `heartbeat` seconds. Only the new options are added to the
+    menu and to the current filter results, the cursor and the scroll position
+    stay where they are. The menu's height isn't changed, so make it as high
+    as it should be before it's shown. Not for menus of an OptionSource.
+    """
+    def __init__(self, live, heartbeat=0.05):
+        self.live = live
+        self.heartbeat = heartbeat
+
+    def _show_start(self):
+        if self.host._heartbeat is None:
+            self.host._heartbeat = self.heartbeat
+        self.parent._show_start()
+
+    def _on_keys(self, keys):
+        options = self.live.take()
+        if options:
+            self.host.add_options(options)
+        return self.parent._on_keys(keys)
+
 class Minimenu(object):
     def __init__(self, options, default=None):
         self.options = options
@@ -578,14 +1480,102 @@ def shorten(s, l=100):
         return s
     return s[:l//2-2] + "..." + s[-l//2+1:]
 
+FUZZY_SEPARATORS = " \t/\\_-.,:;|"
+
+def fuzzy_score(pattern, text):
+    """
+    Score how well `text` matches the lowercase `pattern` when its characters
+    appear in order but not necessarily next to each other. Returns None if
+    they don't appear in order. Consecutive characters and characters at the
+    start of words score higher, gaps between them score lower.
+    """
+    if not pattern:
+        return 0
+    lower = text.lower()
+    if len(lower) != len(text):
+        # lowercasing changed the positions, give up on camelCase boundaries
+        text = lower
+    first = pattern[0]
+    rest = pattern[1:]
+    best = None
+    # try every place the match can start and keep the best one
+    start = lower.find(first)
+    while start >= 0:
+        if start == 0 or text[start-1] in FUZZY_SEPARATORS or (text[start] != first and text[start-1].islower()):
+            bonus = 8
+        else:
+            bonus = 0
+        score = 16 + bonus
+        # consecutive characters get at least the bonus of the first one
+        chunkBonus = bonus
+        prev = start
+        for c in rest:
+            pos = lower.find(c, prev + 1)
+            if pos < 0:
+                # later starts can't match either
+                return best
+            if text[pos-1] in FUZZY_SEPARATORS or (text[pos] != c and text[pos-1].islower()):
+                bonus = 8
+            else:
+                bonus = 0
+            if pos == prev + 1:
+                bonus = max(bonus, chunkBonus, 6)
+            else:
+                score -= 3 + (pos - prev - 2)
+                chunkBonus = bonus
+            score += 16 + bonus
+            prev = pos
+        if best is None or score > best:
+            best = score
+        start = lower.find(first, start + 1)
+    return best
+
+# the terminal size, cached while menus are shown and watch for SIGWINCH
+_terminalSize = None
+_resizeWatchers = 0
+
 def get_terminal_size():
+    global _terminalSize
+    if _terminalSize is not None:
+        return _terminalSize
     import fcntl, termios, struct
     try:
         h, w, hp, wp = struct.unpack('HHHH', fcntl.ioctl(sys.stdin,
             termios.TIOCGWINSZ, struct.pack('HHHH', 0, 0, 0, 0)))
-        return w, h
+        size = w, h
     except OSError:
-        return 80, 25
+        size = 80, 25
+    if _resizeWatchers:
+        _terminalSize = size
+    return size
+
+def _on_sigwinch(signum, frame):
+    global _terminalSize
+    from termenu import keyboard
+    _terminalSize = None
+    keyboard.post("resize")
+
+def _watch_resize():
+    """
+    Cache the terminal size until the terminal is resized, which is reported
+    to the menu as a "resize" key. Returns the SIGWINCH handler to restore.
+    """
+    global _resizeWatchers
+    try:
+        previous = signal.signal(signal.SIGWINCH, _on_sigwinch)
+    except (AttributeError, ValueError):
+        # no SIGWINCH on this platform, or not in the main thread
+        return None
+    _resizeWatchers += 1
+    return previous
+
+def _unwatch_resize(previous):
+    global _terminalSize, _resizeWatchers
+    if previous is None:
+        return
+    signal.signal(signal.SIGWINCH, previous)
+    _resizeWatchers -= 1
+    _terminalSize = None
 
 if __name__ == "__main__":
     odds = OptionGroup("Odd Numbers", [("%06d" % i, i) for i in xrange(1, 10, 2)])
@@ -0,0 +1,224 @@
+import sys
+import heapq
+import array
+import itertools
+import multiprocessing
+from multiprocessing.connection import wait
+from .menu import FilterPlugin, _FilterResult, _LazyOptions, _option_texts
+
+# how many options a worker checks between looking for a newer query
+CHUNK_SIZE = 16384
+
+class _Interrupted(Exception):
+    pass
+
+def _filter_worker(conn, texts):
+    """
+    Search a share of the menu options. Receives (id, query) messages and
+    answers with (id, bytes of an array of matching indices). A search is
+    abandoned as soon as a newer query arrives, a None id stops the worker.
+    """
+    texts = [t.lower() for t in texts]
+    # stack of (query, matches) like FilterPlugin's, narrowing queries only
+    # search the previous matches
+    results = []
+    message = None
+    while True:
+        if message is None:
+            try:
+                message = conn.recv()
+            except EOFError:
+                return
+        queryId, text = message
+        message = None
+        if queryId is None:
+            return
+
+        while results and not text.startswith(results[-1][0]):
+            results.pop()
+        if results and results[-1][0] == text:
+            conn.send((queryId, results[-1][1].tobytes()))
+            continue
+
+        if results:
+            candidates = results[-1][1]
+        else:
+            candidates = range(len(texts))
+        matches = array.array("L")
+        for start in range(0, len(candidates), CHUNK_SIZE):
+            matches.extend(i for i in candidates[start:start+CHUNK_SIZE] if text in texts[i])
+            if conn.poll():
+                message = conn.recv()
+                break
+        else:
+            results.append((text, matches))
+            conn.send((queryId, matches.tobytes()))
+
+class ParallelFilterPlugin(FilterPlugin):
+    """
+    A FilterPlugin that splits the options between worker processes when the
+    menu is created and has them search their share in parallel, sending them
+    only the query on every key. While they work the keyboard is watched and
+    a search that is overtaken by a newer key is abandoned.
+
+    Menus with less than `threshold` options are filtered in-process, as are
+    options added after the menu was created.
+    """
+    def __init__(self, workers=None, threshold=100000):
+        FilterPlugin.__init__(self)
+        self.workers = workers or multiprocessing.cpu_count()
+        self.threshold = threshold
+        self._shards = []
+        self._sharded = 0
+        self._queryId = 0
+        self._pending = False
+        self._always = None
+        # only searches for query edits give way to the keyboard
+        self._interruptible = True
+
+    def _make_option_objects(self, options):
+        objects = FilterPlugin._make_option_objects(self, options)
+        if not self.host._addingOptions:
+            self.close()
+            self._always = None
+            if len(objects) >= self.threshold:
+                self._start_workers(list(_option_texts(objects)))
+        return objects
+
+    def _start_workers(self, texts):
+        try:
+            # workers inherit their share instead of unpickling it
+            context = multiprocessing.get_context("fork")
+        except ValueError:
+            context = multiprocessing.get_context()
+        size = -(-len(texts) // self.workers)
+        for start in range(0, len(texts), size):
+            conn, childConn = context.Pipe()
+            process = context.Process(target=_filter_worker, args=(childConn, texts[start:start+size]))
+            process.daemon = True
+            process.start()
+            childConn.close()
+            self._shards.append((start, conn, process))
+        self._sharded = len(texts)
+
+    def close(self):
+        """
+        Stop the worker processes.
+        """
+        for start, conn, process in self._shards:
+            # forked workers hold copies of the pipes, so closing ours isn't
+            # enough to stop them
+            try:
+                conn.send((None, None))
+            except (IOError, OSError):
+                pass
+            conn.close()
+            process.join(1)
+            if process.is_alive():
+                process.terminate()
+        self._shards = []
+        self._sharded = 0
+
+    def _show_start(self):
+        if self._shards and self.host._heartbeat is None:
+            # collect the results of interrupted searches when idle
+            self.host._heartbeat = 0.1
+        self.parent._show_start()
+
+    def _show_end(self):
+        try:
+            self.parent._show_end()
+        finally:
+            self.close()
+
+    def _on_key(self, key):
+        editing = len(key) == 1 or key in ("backspace", "esc")
+        if editing:
+            return FilterPlugin._on_key(self, key)
+        # other keys act on the matches of the current query, wait for them
+        self._interruptible = False
+        try:
+            if self._pending:
+                self._refilter()
+            return FilterPlugin._on_key(self, key)
+        finally:
+            self._interruptible = True
+
+    def _refilter(self):
+        try:
+            FilterPlugin._refilter(self)
+            self._pending = False
+        except _Interrupted:
+            # the next key either changes the query or collects the results
+            self._pending = True
+
+    def _match(self, candidates, text):
+        if not self._shards or not text:
+            return FilterPlugin._match(self, candidates, text)
+        try:
+            indices = self._search(text)
+        except (EOFError, OSError):
+            # a worker died, search in-process from now on
+            self.close()
+            return FilterPlugin._match(self, candidates, text)
+
+        # options added after the workers started
+        for i, t in enumerate(_option_texts(self._allOptions[self._sharded:])):
+            if text in t.lower():
+                indices.append(self._sharded + i)
+
+        always = self._always_shown()
+        if always:
+            indices = [i for i, _ in itertools.groupby(heapq.merge(indices, always))]
+
+        if isinstance(self._allOptions, _LazyOptions):
+            return _FilterResult(text, self._allOptions.take(indices))
+        return _FilterResult(text, [self._allOptions[i] for i in indices])
+
+    def _always_shown(self):
+        # indices of the options that match any query
+        options = self._allOptions
+        if isinstance(options, _LazyOptions):
+            # only options that were created can have attributes, looking at
+            # the rest would create them all
+            return sorted(i for i, o in options._cache.items() if o.get_attr("showAlways"))
+        if self._always is None:
+            # headers get their attributes after the options are created
+            self._always = [i for i, o in enumerate(options) if o.get_attr("showAlways")]
+        return self._always
+
+    def _search(self, text):
+        self._queryId += 1
+        for start, conn, process in self._shards:
+            conn.send((self._queryId, text))
+
+        starts = dict((conn, start) for start, conn, process in self._shards)
+        results = {}
+        stdin = _stdin_fileno() if self._interruptible else None
+        while len(results) < len(self._shards):
+            waitFor = [conn for conn in starts if starts[conn] not in results]
+            if stdin is not None:
+                waitFor.append(stdin)
+            for ready in wait(waitFor):
+                if ready == stdin:
+                    raise _Interrupted()
+                queryId, data = ready.recv()
+                if queryId == self._queryId:
+                    matches = array.array("L")
+                    matches.frombytes(data)
+                    results[starts[ready]] = matches
+
+        # merge in the original order
+        indices = array.array("L")
+        for start in sorted(results):
+            indices.extend(start + i for i in results[start])
+        return indices
+
+def _stdin_fileno():
+    # only watch the keyboard if there is one
+    try:
+        if sys.stdin.isatty():
+            return sys.stdin.fileno()
+    except (AttributeError, ValueError, OSError):
+        pass
+    return None
@@ -0,0 +1,158 @@
+import os
+import time
+import signal
+import shlex
+import threading
+import subprocess
+import collections
+from concurrent.futures import ThreadPoolExecutor
+from . import ansi
+from . import keyboard
+from .menu import Plugin, get_terminal_size
+
+class _Cancelled(Exception):
+    pass
+
+class PreviewPlugin(Plugin):
+    """
+    Shows a preview of the active option in `lines` rows above the menu.
+    `preview` is either a function that gets the option's result and returns
+    the text to show, or a shell command in which {} is replaced with the
+    quoted result, e.g. "head -20 {}".
+
+    Previews are made on `workers` threads once the cursor rested for `delay`
+    seconds, commands that are still running when the cursor moves on are
+    killed. The last `cacheSize` previews are kept by option result. Until a
+    preview is ready the previous one stays on screen.
+    """
+    def __init__(self, preview, lines=10, workers=2, delay=0.05, cacheSize=100):
+        self.preview = preview
+        self.lines = lines
+        self.workers = workers
+        self.delay = delay
+        self.cacheSize = cacheSize
+        self._cache = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self._pool = None
+        # the preview asked for last and a counter that tells running
+        # previews they were superseded
+        self._wanted = None
+        self._generation = 0
+        self._scheduled = False
+        self._shown = []
+
+    def _show_end(self):
+        try:
+            self.parent._show_end()
+        finally:
+            self.close()
+
+    def close(self):
+        """
+        Stop making previews.
+        """
+        with self._lock:
+            self._generation += 1
+            self._wanted = None
+            pool, self._pool = self._pool, None
+        if pool is not None:
+            pool.shutdown(wait=False)
+
+    def _goto_top(self):
+        self.parent._goto_top()
+        if self.lines:
+            ansi.up(self.lines)
+
+    def _print_menu(self):
+        option = self.host._get_active_option()
+        if option is not None:
+            text = self._get(option)
+            if text is not None:
+                self._shown = text.splitlines()[:self.lines]
+        # as wide as the terminal, short of the last column which would wrap
+        width = get_terminal_size()[0] - 1
+        for i in range(self.lines):
+            line = self._shown[i] if i < len(self._shown) else ""
+            ansi.write("\r" + line.expandtabs()[:width])
+            ansi.clear_eol()
+            ansi.write("\n")
+        return self.parent._print_menu()
+
+    def _clear_menu(self):
+        self.parent._clear_menu()
+        for i in range(self.lines):
+            ansi.up()
+            ansi.clear_eol()
+
+    def _get(self, option):
+        # the preview of an option if it's ready, otherwise have it made
+        key = _cache_key(option)
+        with self._lock:
+            text = self._cache.get(key)
+            if text is not None:
+                self._cache.move_to_end(key)
+                return text
+            if self._wanted is not None and self._wanted[0] == key:
+                return None
+            self._wanted = (key, option.result)
+            self._generation += 1
+            if self._scheduled:
+                # the scheduled preview will make this one instead
+                return None
+            self._scheduled = True
+            if self._pool is None:
+                self._pool = ThreadPoolExecutor(self.workers)
+            pool = self._pool
+        pool.submit(self._make)
+        return None
+
+    def _make(self):
+        # let the cursor settle before making the latest preview asked for
+        time.sleep(self.delay)
+        with self._lock:
+            self._scheduled = False
+            if self._wanted is None:
+                return
+            key, result = self._wanted
+            generation = self._generation
+        try:
+            text = self._run(result, generation)
+        except _Cancelled:
+            return
+        except Exception as e:
+            text = "preview failed: %s" % e
+        with self._lock:
+            self._cache[key] = text
+            while len(self._cache) > self.cacheSize:
+                self._cache.popitem(last=False)
+            if self._wanted is not None and self._wanted[0] == key:
+                self._wanted = None
+        # wake up the menu to show it
+        keyboard.post("preview")
+
+    def _run(self, result, generation):
+        if not isinstance(self.preview, str):
+            return ansi.decolorize(str(self.preview(result)))
+        command = self.preview.replace("{}", shlex.quote(str(result)))
+        # in a session of its own, so the command's children can be killed too
+        process = subprocess.Popen(command, shell=True, stdin=subprocess.DEVNULL,
+                                   stdout=subprocess.PIPE, stderr=subprocess.STDOUT,
+                                   start_new_session=True)
+        while True:
+            try:
+                output = process.communicate(timeout=0.02)[0]
+                break
+            except subprocess.TimeoutExpired:
+                if generation != self._generation:
+                    os.killpg(process.pid, signal.SIGKILL)
+                    process.communicate()
+                    raise _Cancelled()
+        return ansi.decolorize(output.decode("utf8", "replace"))
+
+def _cache_key(option):
+    # results that can't be hashed are told apart by their text
+    try:
+        hash(option.result)
+        return option.result
+    except TypeError:
+        return option.text
@@ -1,8 +1,26 @@
 import sys
 sys.path.append("..")
+import os
+import json
+import signal
+import atexit
+import shutil
+import tempfile
+import time
+import array
+import itertools
+import threading
 import unittest
-from termenu import ansi
-from termenu.menu import Termenu, Plugin, FilterPlugin
+from termenu import ansi, keyboard, trace, menu as menumodule
+from termenu import parallel
+from termenu.parallel import ParallelFilterPlugin
+from termenu import benchmark
+from termenu.instrument import Histogram
+from termenu.filesource import FileSource, IndexCache
+from termenu.itersource import IteratorSource
+from termenu.preview import PreviewPlugin
+from termenu.headless import VirtualScreen, HeadlessTerminal
+from termenu.menu import Termenu, Plugin, register_plugin, FilterPlugin, LiveOptions, LivePlugin, OptionSource, OptionGroup, OptionGroupPlugin, TitlePlugin, PrecoloredPlugin, fuzzy_score, shorten
 
 OPTIONS = ["%02d" % i for i in range(1,100)]
 RESULTS = ["result-%02d" % i for i in range(1,100)]
@@ -10,6 +28,21 @@ RESULTS = ["result-%02d" % i for i in range(1,100)]
 def strmenu(menu):
     return menu._get_debug_view()
 
+class OutputTestCase(unittest.TestCase):
+    """
+    Collects what is written to the terminal in self.written instead.
+    """
+    def setUp(self):
+        self.written = []
+        self._write = ansi._write
+        ansi._write = self.written.append
+        self.addCleanup(setattr, ansi, "_write", self._write)
+
+    def frame(self, menu):
+        del self.written[:]
+        menu._print_menu()
+        return "".join(self.written)
+
 class Down(unittest.TestCase):
     def test_cursor_top(self):
         menu = Termenu(OPTIONS, height=3)
@@ -172,6 +205,10 @@ class Default(unittest.TestCase):
         assert strmenu(menu) == "(17) 18 19 20"
         assert " ".join(menu.get_result()) == "05 17 93"
 
+    def test_multiple_repeated(self):
+        menu = Termenu(["a", "b", "a", "c"], default=["a", "c"])
+        assert menu.get_result() == ["a", "a", "c"]
+
     def test_multiple_empty_list(self):
         menu = Termenu(OPTIONS, height=4, default=[])
         assert strmenu(menu) == "(01) 02 03 04"
@@ -204,6 +241,137 @@ class MultiSelect(unittest.TestCase):
         assert strmenu(menu) == "(01) 02 03 04"
         assert menu.get_result() == "01"
 
+class Selection(unittest.TestCase):
+    def test_select_all_matches(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin()])
+        menu._on_key("5")
+        menu.select_all()
+        menu._on_key("esc")
+        assert strmenu(menu) == "(01) 02 03 04"
+        assert menu.get_result() == ["05", "15", "25", "35", "45", "50", "51", "52", "53", "54", "55", "56", "57", "58", "59", "65", "75", "85", "95"]
+
+    def test_invert_and_clear(self):
+        menu = Termenu(OPTIONS[:6], height=4)
+        menu._on_space()
+        menu.invert_selection()
+        assert menu.get_result() == ["02", "03", "04", "05", "06"]
+        menu.clear_selection()
+        assert menu.get_result() == ["02"]
+
+    def test_result_order(self):
+        menu = Termenu(OPTIONS, height=4)
+        menu._on_down()
+        menu._on_down()
+        menu._on_space()
+        menu._on_up()
+        menu._on_up()
+        menu._on_up()
+        menu._on_space()
+        assert menu.get_result() == ["01", "03"]
+
+    def test_added_options(self):
+        menu = Termenu(OPTIONS[:2], height=4)
+        menu.add_options(["x", "y"])
+        menu.scroll = 0
+        menu.cursor = 3
+        menu._on_space()
+        menu.scroll = menu.cursor = 0
+        menu._on_space()
+        assert menu.get_result() == ["01", "y"]
+
+    def test_lazy(self):
+        source = NumberSource(99)
+        menu = Termenu(source, height=4, plugins=[FilterPlugin()])
+        menu._on_key("5")
+        menu.select_all()
+        assert len(menu.options._cache) < 20
+        menu._on_key("esc")
+        menu._on_space()
+        menu.invert_selection()
+        assert len(menu.options._cache) < 20
+        result = menu.get_result()
+        assert len(result) == 99 - 19 - 1
+        assert "result-01" not in result and "result-05" not in result and "result-02" in result
+
+    def test_groups(self):
+        options = [OptionGroup("Odd", ["one", "three"]), OptionGroup("Even", ["two", "four"])]
+        menu = Termenu(options, height=6, plugins=[FilterPlugin(), OptionGroupPlugin()])
+        menu._on_key("o")
+        menu.select_all()
+        # headers can't be selected
+        assert menu.get_result() == ["one", "two", "four"]
+        menu._on_key("esc")
+        menu.invert_selection()
+        assert menu.get_result() == ["three"]
+
+    def test_single(self):
+        menu = Termenu(OPTIONS, height=4, multiselect=False)
+        menu.select_all()
+        assert menu.get_result() == "01"
+
+class Lookup(unittest.TestCase):
+    def test_select_by_text(self):
+        menu = Termenu(OPTIONS, height=4)
+        assert menu.select_by_text(["93", "05", "xx"]) == 2
+        assert menu.get_result() == ["05", "93"]
+
+    def test_select_by_result(self):
+        menu = Termenu(zip(OPTIONS, RESULTS), height=4)
+        assert menu.select_by_result(["result-17", [], "result-02"]) == 2
+        assert menu.get_result() == ["result-02", "result-17"]
+
+    def test_select_hidden(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin()])
+        menu._on_key("5")
+        menu.select_by_text(["01"])
+        assert menu.get_result() == ["01"]
+
+    def test_jump(self):
+        menu = Termenu(OPTIONS, height=4)
+        assert menu.jump_to_text("50")
+        assert strmenu(menu) == "(50) 51 52 53"
+        assert menu.jump_to_result("98")
+        assert strmenu(menu) == "96 97 (98) 99"
+        assert not menu.jump_to_text("xx")
+        assert strmenu(menu) == "96 97 (98) 99"
+
+    def test_jump_filtered(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin()])
+        menu._on_key("5")
+        assert menu.jump_to_text("55")
+        assert menu._get_active_option().text == "55"
+        assert not menu.jump_to_text("44")
+        assert menu._get_active_option().text == "55"
+
+    def test_added_options(self):
+        menu = Termenu(OPTIONS[:4], height=4)
+        assert not menu.jump_to_text("x")
+        menu.add_options(["x", "y"])
+        assert menu.jump_to_text("y")
+        assert menu._get_active_option().text == "y"
+
+    def test_source(self):
+        source = NumberSource(99)
+        menu = Termenu(source, height=4, default="60")
+        assert strmenu(menu) == "(60) 61 62 63"
+        menu.select_by_result(["result-70"])
+        assert menu.get_result() == ["result-70"]
+        assert len(menu.options._cache) < 10
+
+    def test_add_to_source(self):
+        menu = Termenu(NumberSource(10), height=4)
+        self.assertRaises(TypeError, menu.add_options, ["x"])
+
+    def test_grown_source(self):
+        source = NumberSource(50)
+        menu = Termenu(source, height=4)
+        assert menu.jump_to_text("10")
+        source.count = 60
+        source.reads = 0
+        assert menu.jump_to_text("55")
+        # the ten new rows and the ones shown, not the rows indexed before
+        assert source.reads < 20
+
 class Results(unittest.TestCase):
     def test_single(self):
         menu = Termenu(zip(OPTIONS, RESULTS), height=4)
@@ -221,6 +389,203 @@ class Results(unittest.TestCase):
         assert strmenu(menu) == "01 02 (03) 04"
         assert menu.get_result() == ["result-01", "result-02"]
 
+class AddOptions(unittest.TestCase):
+    def test_add(self):
+        menu = Termenu(OPTIONS[:2], height=4)
+        menu.add_options(OPTIONS[2:])
+        assert strmenu(menu) == "(01) 02"
+        menu._on_end()
+        assert strmenu(menu) == "98 (99)"
+        assert menu.get_result() == ["99"]
+
+    def test_empty(self):
+        menu = Termenu([], height=4)
+        assert menu.get_result() == []
+        menu.add_options(OPTIONS)
+        assert menu.get_result() == ["01"]
+
+class Live(OutputTestCase):
+    def test_push_from_thread(self):
+        live = LiveOptions(["a"])
+        thread = threading.Thread(target=lambda: (live.push(["b", "c"]), live.close()))
+        thread.start()
+        live.wait(10, 5)
+        thread.join()
+        assert live.done
+        assert live.take() == ["a", "b", "c"]
+        assert live.take() == []
+
+    def test_wait_timeout(self):
+        live = LiveOptions()
+        live.wait(1, 0.01)
+        assert not live.done
+
+    def test_keeps_position(self):
+        live = LiveOptions()
+        menu = Termenu(OPTIONS[:6], height=4, plugins=[LivePlugin(live)])
+        menu._on_end()
+        assert strmenu(menu) == "03 04 05 (06)"
+        live.push(["x", "y"])
+        menu._show_keys(["heartbeat"])
+        assert strmenu(menu) == "03 04 05 (06)"
+        menu._on_end()
+        assert strmenu(menu) == "05 06 x (y)"
+
+    def test_filtered(self):
+        live = LiveOptions()
+        menu = Termenu(OPTIONS[:20], height=4, plugins=[FilterPlugin(), LivePlugin(live)])
+        menu._show_keys(["1"])
+        assert strmenu(menu) == "(01) 10 11 12"
+        live.push(["21", "x1", "y"])
+        menu._show_keys(["heartbeat"])
+        menu._on_end()
+        assert strmenu(menu) == "18 19 21 (x1)"
+        menu._show_keys(["backspace"])
+        menu._on_end()
+        assert strmenu(menu) == "20 21 x1 (y)"
+
+    def test_idle_redraw(self):
+        live = LiveOptions()
+        menu = Termenu(OPTIONS[:2], height=4, plugins=[LivePlugin(live)])
+        menu.height = 4
+        menu._show_keys(["heartbeat"])
+        assert self.written == []
+        live.push(["x"])
+        menu._show_keys(["heartbeat"])
+        assert len(self.written) == 1
+        # below the window
+        live.push(["y", "z"])
+        menu._show_keys(["heartbeat"])
+        assert len(self.written) == 2
+        live.push(["w"])
+        menu._show_keys(["heartbeat"])
+        assert len(self.written) == 2
+        menu._show_keys(["down"])
+        assert len(self.written) == 3
+
+class Options(unittest.TestCase):
+    def test_no_instance_dict(self):
+        menu = Termenu(OPTIONS, height=4)
+        assert not hasattr(menu.options[0], "__dict__")
+
+    def test_attrs(self):
+        menu = Termenu(OPTIONS, height=4)
+        option = menu.options[0]
+        assert option.attrs == {}
+        assert option.get_attr("header") is None
+        option.attrs["header"] = True
+        option.attrs["showAlways"] = True
+        assert option.attrs == dict(header=True, showAlways=True)
+        assert option.get_attr("header") is True
+        assert menu.options[1].attrs == {}
+
+class NumberSource(OptionSource):
+    def __init__(self, count):
+        self.count = count
+        self.accessed = set()
+        self.reads = 0
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, index):
+        self.accessed.add(index)
+        self.reads += 1
+        return ("%02d" % (index + 1), "result-%02d" % (index + 1))
+
+    def width_hint(self):
+        return 2
+
+class ColoredSource(NumberSource):
+    def __getitem__(self, index):
+        text, result = NumberSource.__getitem__(self, index)
+        return (ansi.colorize(text, "red"), ansi.colorize(result, "red"))
+
+class Source(unittest.TestCase):
+    def test_precolored(self):
+        source = ColoredSource(99)
+        menu = Termenu(source, height=4, plugins=[FilterPlugin(), PrecoloredPlugin()])
+        option = menu.options[0]
+        assert isinstance(option.text, ansi.ansistr)
+        assert len(option.text) == 2
+        assert menu.get_result() == ["result-01"]
+        assert len(menu.options._cache) == 1
+
+    def test_window_only(self):
+        source = NumberSource(99)
+        menu = Termenu(source, height=4)
+        assert strmenu(menu) == "(01) 02 03 04"
+        assert source.accessed == set([0, 1, 2, 3])
+        assert menu.width == 2
+
+    def test_scroll(self):
+        menu = Termenu(NumberSource(99), height=4)
+        menu._on_end()
+        assert strmenu(menu) == "96 97 98 (99)"
+
+    def test_default(self):
+        menu = Termenu(NumberSource(99), height=4, default="55")
+        assert strmenu(menu) == "(55) 56 57 58"
+
+    def test_results(self):
+        menu = Termenu(NumberSource(99), height=4)
+        menu._on_space()
+        menu._on_space()
+        menu._on_end()
+        assert menu.get_result() == ["result-01", "result-02"]
+
+    def test_filter(self):
+        menu = Termenu(NumberSource(99), height=4, plugins=[FilterPlugin()])
+        menu._on_key("4")
+        assert strmenu(menu) == "(04) 14 24 34"
+        menu._on_key("backspace")
+        assert strmenu(menu) == "(01) 02 03 04"
+
+def numbers(start=0):
+    return ("%02d" % (n + 1) for n in itertools.count(start))
+
+class IteratorSourceTest(unittest.TestCase):
+    def test_prefetch(self):
+        source = IteratorSource(numbers(), prefetch=10)
+        menu = Termenu(source, height=4)
+        assert strmenu(menu) == "(01) 02 03 04"
+        assert len(source) == 10
+        assert source[50] == "51"
+        source.wait(60)
+        assert len(source) >= 60
+        assert not source.done
+
+    def test_end(self):
+        source = IteratorSource(OPTIONS[:6], prefetch=10)
+        assert source.done
+        menu = Termenu(source, height=4)
+        menu._on_end()
+        assert strmenu(menu) == "03 04 05 (06)"
+
+    def test_drop_and_reread(self):
+        reopened = []
+        def reopen(start):
+            reopened.append(start)
+            return numbers(start)
+        source = IteratorSource(numbers(), prefetch=10, reopen=reopen, keep=20)
+        source.wait(100)
+        assert source[90] == "91"
+        assert len(source._rows) < 100
+        assert source[5] == "06"
+        assert reopened == [0]
+        assert source[6] == "07"
+        assert reopened == [0]
+
+    def test_forget_options(self):
+        source = IteratorSource(numbers(), prefetch=10, keep=10)
+        menu = Termenu(source, height=4)
+        menu._on_space()
+        source.wait(100)
+        for i in range(90):
+            menu.options[i]
+        assert len(menu.options._cache) <= 20
+        assert menu.get_result() == ["01"]
+
 def active(s):
     return ansi.colorize(s, "black", "white")
 
@@ -233,6 +598,451 @@ def active_selected(s):
 def white(s):
     return ansi.colorize(s, "white", bright=True)
 
+class FileSourceTest(unittest.TestCase):
+    LINES = ["alpha one", "  Beta   two ", "alpha one", "gamma\tthree", "", "  alpha  one", "delta"]
+
+    def setUp(self):
+        self.path = tempfile.mktemp()
+        with open(self.path, "w") as f:
+            f.write("\n".join(self.LINES) + "\n")
+
+    def tearDown(self):
+        os.remove(self.path)
+
+    def test_lines(self):
+        source = FileSource(self.path)
+        assert [source[i] for i in range(len(source))] == ["alpha one", "Beta two", "gamma three", "", "delta"]
+        assert len(FileSource(self.path, unique=False)) == 7
+        assert source.width_hint() == len("gamma three")
+
+    def test_search(self):
+        source = FileSource(self.path)
+        assert list(source.search("beta")) == [1]
+        assert list(source.search("a t")) == [1, 2]
+        assert list(source.search("a")) == [0, 1, 2, 4]
+        assert list(source.search("a", array.array("L", [2, 4]))) == [2, 4]
+        # leading whitespace is stripped from the options
+        assert list(source.search(" beta")) == []
+
+    def test_filter(self):
+        menu = Termenu(FileSource(self.path), height=3, plugins=[FilterPlugin()])
+        menu._on_key("t")
+        assert strmenu(menu) == "(Beta two) gamma three delta"
+        menu._on_key("a")
+        assert strmenu(menu) == "(Beta two) delta"
+        assert menu.get_result() == ["Beta two"]
+
+class IndexCacheTest(unittest.TestCase):
+    def setUp(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "options.txt")
+        self.cache = IndexCache(os.path.join(self.directory, "cache"))
+        self.write(["Alpha", "beta", "alpha", "Alpha"])
+
+    def tearDown(self):
+        shutil.rmtree(self.directory)
+
+    def write(self, lines, mtime=1000000):
+        with open(self.path, "w") as f:
+            f.write("\n".join(lines) + "\n")
+        os.utime(self.path, (mtime, mtime))
+
+    def test_warm(self):
+        cold = FileSource(self.path, cache=self.cache)
+        warm = FileSource(self.path, cache=self.cache)
+        assert cold._lower is None and warm._lower is not None
+        assert [warm[i] for i in range(len(warm))] == ["Alpha", "beta", "alpha"]
+        assert list(warm.search("alpha")) == list(cold.search("alpha")) == [0, 2]
+        assert warm.width_hint() == 5
+
+    def test_changed(self):
+        FileSource(self.path, cache=self.cache)
+        self.write(["gamma"], mtime=2000000)
+        source = FileSource(self.path, cache=self.cache)
+        assert source._lower is None
+        assert [source[i] for i in range(len(source))] == ["gamma"]
+
+    def truncate(self, suffix, size):
+        for name in os.listdir(self.cache.directory):
+            if name.endswith(suffix):
+                with open(os.path.join(self.cache.directory, name), "r+b") as f:
+                    f.truncate(size)
+
+    def test_truncated(self):
+        for suffix in (".index", ".lower"):
+            FileSource(self.path, cache=self.cache)
+            self.truncate(suffix, 4)
+            source = FileSource(self.path, cache=self.cache)
+            assert source._lower is None
+            assert [source[i] for i in range(len(source))] == ["Alpha", "beta", "alpha"]
+            assert FileSource(self.path, cache=self.cache)._lower is not None
+
+    def test_unwritable(self):
+        # a file where the cache directory should be
+        cache = IndexCache(self.path)
+        source = FileSource(self.path, cache=cache)
+        assert [source[i] for i in range(len(source))] == ["Alpha", "beta", "alpha"]
+        assert os.listdir(self.directory) == ["options.txt"]
+
+    def test_evict(self):
+        self.cache.maxSize = 0
+        FileSource(self.path, cache=self.cache)
+        other = os.path.join(self.directory, "other.txt")
+        with open(other, "w") as f:
+            f.write("x\n")
+        FileSource(other, cache=self.cache)
+        # only the most recent index is kept
+        assert FileSource(other, cache=self.cache)._lower is not None
+        assert FileSource(self.path, cache=IndexCache(self.cache.directory))._lower is None
+
+class Buffered(OutputTestCase):
+    def test_single_write(self):
+        with ansi.buffered():
+            ansi.write("a")
+            ansi.up()
+            ansi.clear_eol()
+            assert self.written == []
+        assert self.written == ["a\x1b[1A\x1b[0K"]
+
+    def test_nested(self):
+        with ansi.buffered():
+            ansi.write("a")
+            with ansi.buffered():
+                ansi.write("b")
+            ansi.write("c")
+        assert self.written == ["abc"]
+
+    def test_unbuffered(self):
+        ansi.write("a")
+        ansi.write("b")
+        assert self.written == ["a", "b"]
+
+    def test_show_keys_single_frame(self):
+        menu = Termenu(["%02d" % i for i in range(20)], height=3)
+        assert not menu._show_keys(["down", "down", "down"])
+        assert len(self.written) == 1
+        assert strmenu(menu) == "01 02 (03)"
+        assert menu._show_keys(["enter"])
+        assert len(self.written) == 1
+
+class Resize(OutputTestCase):
+    def tearDown(self):
+        menumodule._terminalSize = None
+        keyboard._take_posted()
+
+    def test_post(self):
+        keyboard.post("resize")
+        keyboard.post("x")
+        assert keyboard._take_posted() == ["resize", "x"]
+        assert keyboard._take_posted() == []
+
+    def test_sigwinch(self):
+        previous = menumodule._watch_resize()
+        try:
+            menumodule._terminalSize = (20, 10)
+            os.kill(os.getpid(), signal.SIGWINCH)
+            assert keyboard._take_posted() == ["resize"]
+            assert menumodule._terminalSize is None
+            size = menumodule.get_terminal_size()
+            assert menumodule._terminalSize == size
+        finally:
+            menumodule._unwatch_resize(previous)
+        assert menumodule._terminalSize is None
+        assert signal.getsignal(signal.SIGWINCH) is previous
+
+    def test_width(self):
+        menumodule._terminalSize = (100, 10)
+        menu = Termenu(["x" * 50, "y"], plugins=[FilterPlugin()])
+        assert menu.width == 50
+        menu._on_key("y")
+        menumodule._terminalSize = (20, 10)
+        menu._on_key("resize")
+        assert menu.width == 20 - len(menu._decorate(""))
+        menumodule._terminalSize = (200, 10)
+        menu._on_key("resize")
+        assert menu.width == 50
+        assert menu._lineCache == {}
+
+    def test_single_frame(self):
+        menu = Termenu(["%02d" % i for i in range(20)], height=3)
+        menu._show_start()
+        del self.written[:]
+        menu._show_keys(["resize"])
+        # the rows are cleared and drawn again in one write
+        assert len(self.written) == 1
+        assert self.written[0].index("\x1b[0K") < self.written[0].index("00")
+        menu._show_end()
+
+class Preview(OutputTestCase):
+    def setUp(self):
+        OutputTestCase.setUp(self)
+        keyboard._take_posted()
+
+    def tearDown(self):
+        keyboard._take_posted()
+
+    def wait_for_preview(self):
+        deadline = time.time() + 5
+        while "preview" not in keyboard._take_posted():
+            assert time.time() < deadline
+            time.sleep(0.01)
+
+    def test_function(self):
+        plugin = PreviewPlugin(lambda result: "about %s\nline 2\nline 3" % result, lines=2, delay=0)
+        menu = Termenu(zip(OPTIONS, RESULTS), height=4, plugins=[plugin])
+        assert "about" not in self.frame(menu)
+        self.wait_for_preview()
+        frame = self.frame(menu)
+        assert "about result-01" in frame
+        assert "line 2" in frame
+        assert "line 3" not in frame
+        # the previous preview stays until the next one is ready
+        menu._on_down()
+        assert "about result-01" in self.frame(menu)
+        self.wait_for_preview()
+        assert "about result-02" in self.frame(menu)
+        plugin.close()
+
+    def test_command(self):
+        plugin = PreviewPlugin("echo preview of {}", lines=1, delay=0)
+        menu = Termenu(["it's"], plugins=[plugin])
+        self.frame(menu)
+        self.wait_for_preview()
+        assert "preview of it's" in self.frame(menu)
+        plugin.close()
+
+    def test_cancel(self):
+        plugin = PreviewPlugin("sleep 5; echo {}", lines=1, delay=0)
+        menu = Termenu(OPTIONS, height=4, plugins=[plugin])
+        start = time.time()
+        self.frame(menu)
+        time.sleep(0.1)
+        pool = plugin._pool
+        plugin.close()
+        pool.shutdown(wait=True)
+        assert plugin._cache == {}
+        assert time.time() - start < 2
+
+    def test_cache(self):
+        calls = []
+        def preview(result):
+            calls.append(result)
+            return result
+        plugin = PreviewPlugin(preview, lines=1, delay=0, cacheSize=2)
+        menu = Termenu(OPTIONS, height=4, plugins=[plugin])
+        for i in range(3):
+            self.frame(menu)
+            self.wait_for_preview()
+            menu._on_down()
+        menu._on_up()
+        self.frame(menu)
+        assert calls == ["01", "02", "03"]
+        assert list(plugin._cache) == ["02", "03"]
+        plugin.close()
+
+    def test_geometry(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[PreviewPlugin(str, lines=3)])
+        menu._goto_top()
+        assert "".join(self.written) == "\x1b[u\x1b[4A\x1b[3A"
+        del self.written[:]
+        menu._clear_menu()
+        assert "".join(self.written).count("\x1b[0K") == 4 + 1 + 3
+
+class AnsiStr(unittest.TestCase):
+    RAW = "ab" + ansi.colorize("cdef", "red") + "gh"
+
+    def test_len(self):
+        assert len(ansi.ansistr(self.RAW)) == 8
+        assert len(ansi.ansistr("plain")) == 5
+
+    def test_slice(self):
+        s = ansi.ansistr(self.RAW)
+        assert s[1:4] == "b\x1b[0;0;31;49mcd\x1b[0;m"
+        assert s[5:] == "\x1b[0;0;31;49mf\x1b[0;mgh"
+        assert s[-2:] == "\x1b[0;0;31;49m\x1b[0;mgh"
+        assert s[4] == "e"
+        assert isinstance(s[1:4], ansi.ansistr)
+        assert s[1:4].decolorize() == "bcd"
+
+    def test_add(self):
+        s = ansi.ansistr(self.RAW)
+        assert len(s + "xy") == 10
+        assert len("xy" + s) == 10
+        assert isinstance("xy" + s, ansi.ansistr)
+
+    def test_shorten(self):
+        s = ansi.ansistr(ansi.colorize("0123456789" * 3, "red"))
+        short = shorten(s, 10)
+        assert len(short) == 10
+        assert short.decolorize() == "012...6789"
+        assert short.startswith("\x1b[0;0;31;49m") and short.endswith("\x1b[0;m")
+
+class Keyboard(unittest.TestCase):
+    def test_plain(self):
+        assert keyboard._decode("ab \n\x7f") == (["a", "b", "space", "enter", "backspace"], "")
+
+    def test_sequences(self):
+        keys, rest = keyboard._decode("19\x1b[B\x1b[B\x1b[15~x")
+        assert keys == ["1", "9", "down", "down", "F5", "x"]
+        assert rest == ""
+
+    def test_esc(self):
+        assert keyboard._decode("\x1bx\x1b\x1b[A") == (["esc", "x", "esc", "up"], "")
+
+    def test_split(self):
+        assert keyboard._decode("a\x1b[1") == (["a"], "\x1b[1")
+        assert keyboard._decode("\x1b[1" + "5~") == (["F5"], "")
+        assert keyboard._decode("\x1b") == ([], "\x1b")
+
+    def test_final(self):
+        assert keyboard._decode("\x1b", final=True) == (["esc"], "")
+        assert keyboard._decode("\x1b[", final=True) == (["esc", "["], "")
+
+class Stats(OutputTestCase):
+    def test_counters(self):
+        samples = []
+        menu = Termenu(["%02d" % i for i in range(20)], height=4, plugins=[FilterPlugin()])
+        stats = menu.enable_stats(lambda name, value: samples.append(name))
+        menu._show_start()
+        menu._show_keys(["down", "1"])
+        assert stats.histograms["on_key"].count == 2
+        assert stats.histograms["refilter"].count == 1
+        assert stats.histograms["print_menu"].count == 2
+        assert samples.count("on_key") == 2
+        # the first frame has no cached rows, moving down redraws all rows
+        # after filtering
+        assert (stats.cacheHits, stats.cacheMisses) == (0, 8)
+        menu._show_keys(["down"])
+        assert (stats.cacheHits, stats.cacheMisses) == (2, 10)
+        assert stats.cache_hit_rate() == 2 / 12.0
+        menu.disable_stats()
+        menu._show_keys(["down"])
+        assert stats.histograms["on_key"].count == 3
+
+    def test_writes(self):
+        ansi._write = self._write
+        terminal = HeadlessTerminal(show_with_stats, rows=10, columns=20)
+        terminal.start()
+        terminal.send("down")
+        terminal.send("enter")
+        result, writes, size, syscalls = terminal.wait()
+        assert result == "01"
+        # the first frame, the frame after moving down and clearing the menu
+        assert writes["count"] == size["count"] == syscalls["count"] == 3
+        assert writes["total"] > 0 and syscalls["min"] >= 1
+        # the terminal adds a carriage return to every newline
+        assert 0 < size["total"] <= sum(f.bytes for f in terminal.frames)
+
+    def test_nested_writes(self):
+        ansi._write = self._write
+        read, write = os.pipe()
+        stdout = sys.stdout
+        sys.stdout = os.fdopen(write, "w")
+        try:
+            outer = Termenu(["a", "b"])
+            inner = Termenu(["c", "d"])
+            outerStats = outer.enable_stats()
+            innerStats = inner.enable_stats()
+            with outer._measuring():
+                outer._show_start()
+                with inner._measuring():
+                    inner._show_start()
+                ansi.write("x")
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        written = os.read(read, 65536)
+        os.close(read)
+        assert outerStats.histograms["write"].count == 2
+        assert innerStats.histograms["write"].count == 1
+        assert outerStats.histograms["write_bytes"].total + innerStats.histograms["write_bytes"].total == len(written)
+
+    def test_histogram(self):
+        histogram = Histogram(1e6)
+        for value in [0.000001, 0.00001, 0.0001, 0.001]:
+            histogram.add(value)
+        assert histogram.count == 4
+        assert histogram.min == 0.000001 and histogram.max == 0.001
+        assert histogram.percentile(0.5) <= 0.0000161
+        assert histogram.percentile(1) == 0.001
+
+class Trace(OutputTestCase):
+    def setUp(self):
+        OutputTestCase.setUp(self)
+        self.path = tempfile.mktemp(suffix=".json")
+        os.environ[trace.ENVIRONMENT_VARIABLE] = self.path
+
+    def tearDown(self):
+        del os.environ[trace.ENVIRONMENT_VARIABLE]
+        if trace._tracer is not None:
+            ansi.remove_write_observer(trace._tracer._on_write)
+            atexit.unregister(trace._tracer.save)
+            trace._tracer = None
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+    def test_trace(self):
+        menu = Termenu(["%02d" % i for i in range(20)], height=4, plugins=[FilterPlugin(), OptionGroupPlugin()])
+        menu._show_start()
+        menu._show_keys(["1"])
+        menu._show_end()
+        with open(self.path) as f:
+            events = json.load(f)["traceEvents"]
+        names = [e["name"] for e in events]
+        for name in ["FilterPlugin._on_key", "Termenu._on_key", "OptionGroupPlugin._decorate", "refilter", "print_menu"]:
+            assert name in names, name
+        assert [e["args"] for e in events if e["name"] == "on_key"] == [dict(key="1")]
+        assert all(e["ph"] == "X" for e in events)
+
+    def test_overriding_plugins(self):
+        menu = Termenu(["%02d" % i for i in range(20)], height=4, plugins=[FilterPlugin(), TitlePlugin("t")])
+        menu._print_menu()
+        names = [e["name"] for e in trace._tracer.events]
+        for name in ["TitlePlugin._print_menu", "FilterPlugin._print_menu", "Termenu._print_menu"]:
+            assert name in names, name
+
+    def test_no_plugins(self):
+        menu = Termenu(["a", "b"])
+        menu._on_key("down")
+        assert trace._tracer.events[-1]["name"] == "Termenu._on_key"
+
+    def test_disabled(self):
+        del os.environ[trace.ENVIRONMENT_VARIABLE]
+        menu = Termenu(["a", "b"], plugins=[FilterPlugin()])
+        os.environ[trace.ENVIRONMENT_VARIABLE] = self.path
+        assert menu._tracer is None
+        # plugin methods are called directly
+        assert menu._on_key.__self__ is menu._plugins[-1]
+
+class ScrollLines(OutputTestCase):
+    def test_scroll_down(self):
+        menu = Termenu(OPTIONS, height=4)
+        menu.cursor = 3
+        self.frame(menu)
+        menu._on_down()
+        frame = self.frame(menu)
+        assert frame.startswith("\r\x1b[1M\x1b[3B\x1b[1L\x1b[3A\r")
+        # 02 gets a "more above" indicator, 04 loses the cursor, 05 is new
+        assert frame.count("\n") == 3
+
+    def test_scroll_up(self):
+        menu = Termenu(OPTIONS, height=4)
+        menu.scroll = 10
+        self.frame(menu)
+        menu._on_up()
+        frame = self.frame(menu)
+        assert frame.startswith("\r\x1b[3B\x1b[1M\x1b[3A\x1b[1L\r")
+        assert frame.count("\n") == 3
+
+    def test_page_down_repaints(self):
+        menu = Termenu(OPTIONS, height=4)
+        menu.cursor = 3
+        self.frame(menu)
+        menu._on_pageDown()
+        frame = self.frame(menu)
+        assert "\x1b[1M" not in frame
+        assert frame.count("\n") == 4
+
 class Decorate(unittest.TestCase):
     def test_active(self):
         menu = Termenu(OPTIONS, height=4)
@@ -314,6 +1124,22 @@ class Plugins(unittest.TestCase):
         assert strmenu(menu) == "(01) 02 03 04"
         assert [p.ran for p in plugins] == [False, False, True]
 
+    def test_plugins_between(self):
+        # a plugin that doesn't handle a method passes it on to the previous one
+        plugins = [self.SamplePlugin(True), Plugin(), self.SamplePlugin(True)]
+        menu = Termenu(OPTIONS, height=4, plugins=plugins)
+        menu._on_key("down")
+        assert strmenu(menu) == "01 (02) 03 04"
+        assert [p.ran for p in plugins[::2]] == [True, True]
+
+    def test_register_later(self):
+        menu = Termenu(OPTIONS, height=4)
+        plugin = self.SamplePlugin(False)
+        register_plugin(menu, plugin)
+        menu._on_key("down")
+        assert strmenu(menu) == "(01) 02 03 04"
+        assert plugin.ran
+
 class FilterPluginTest(unittest.TestCase):
     def test_filter(self):
         menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin()])
@@ -346,5 +1172,263 @@ class FilterPluginTest(unittest.TestCase):
         menu._on_key("esc")
         assert strmenu(menu) == "(one) two three four"
 
+    def test_add_options(self):
+        menu = Termenu("one two three".split(), height=4, plugins=[FilterPlugin()])
+        menu._on_key("e")
+        menu._on_key("n")
+        assert strmenu(menu) == ""
+        menu.add_options("four five six seven".split())
+        assert strmenu(menu) == "(seven)"
+        menu._on_key("backspace")
+        assert strmenu(menu) == "(one) three five"
+        menu._on_key("esc")
+        assert strmenu(menu) == "(one) two three"
+        menu._on_end()
+        assert strmenu(menu) == "five six (seven)"
+
+    def test_batch_refilters_once(self):
+        plugin = FilterPlugin()
+        menu = Termenu(OPTIONS, height=4, plugins=[plugin])
+        refilters = []
+        refilter = plugin._refilter
+        plugin._refilter = lambda: refilters.append(1) or refilter()
+        menu._on_keys(["4", "x", "backspace", "9"])
+        assert strmenu(menu) == "(49)"
+        assert len(refilters) == 1
+
+    def test_batch_navigation_after_edit(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin()])
+        menu._on_keys(["4", "down", "down", "esc", "9", "backspace", "4"])
+        assert strmenu(menu) == "(04) 14 24 34"
+        menu._on_keys(["esc", "down", "up", "down"])
+        assert strmenu(menu) == "01 (02) 03 04"
+        menu._on_keys(["4", "down", "down"])
+        assert strmenu(menu) == "04 14 (24) 34"
+
+    def test_batch_stops(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin()])
+        assert menu._on_keys(["5", "down", "enter", "down"])
+        assert menu.get_result() == ["15"]
+
+    def test_backspace_reuses_results(self):
+        menu = Termenu("one two three four five six seven".split(), height=4, plugins=[FilterPlugin()])
+        menu._on_key("e")
+        options = menu.options
+        menu._on_key("n")
+        menu._on_key("backspace")
+        assert menu.options is options
+        assert strmenu(menu) == "(one) three five seven"
+
+    def test_narrowing_searches_previous_results(self):
+        menu = Termenu("one two three four five six seven".split(), height=4, plugins=[FilterPlugin()])
+        menu._on_key("e")
+        del menu.options[-1]
+        menu._on_key("n")
+        assert strmenu(menu) == ""
+        menu._on_key("backspace")
+        menu._on_key("backspace")
+        menu._on_key("o")
+        assert strmenu(menu) == "(one) two four"
+
+class ParallelFilterTest(unittest.TestCase):
+    def menu(self, options, **kwargs):
+        plugin = ParallelFilterPlugin(workers=3, threshold=0)
+        self.addCleanup(plugin.close)
+        return Termenu(options, plugins=[plugin] + kwargs.pop("plugins", []), **kwargs)
+
+    def test_filter(self):
+        menu = self.menu(OPTIONS, height=4)
+        menu._on_key("4")
+        assert strmenu(menu) == "(04) 14 24 34"
+        menu._on_end()
+        assert strmenu(menu) == "64 74 84 (94)"
+        menu._on_key("9")
+        assert strmenu(menu) == "(49)"
+        menu._on_key("backspace")
+        assert strmenu(menu) == "(04) 14 24 34"
+        menu._on_key("esc")
+        assert strmenu(menu) == "(01) 02 03 04"
+
+    def test_add_options(self):
+        menu = self.menu(OPTIONS, height=4)
+        menu.add_options(["x4", "y4"])
+        menu._on_key("4")
+        menu._on_end()
+        assert strmenu(menu) == "84 94 x4 (y4)"
+
+    def test_groups(self):
+        options = [OptionGroup("Odd", ["one", "three"]), OptionGroup("Even", ["two", "four"])]
+        menu = self.menu(options, height=4, plugins=[OptionGroupPlugin()])
+        menu._on_key("o")
+        assert strmenu(menu) == "Odd (one) Even two"
+
+    def test_lazy_source(self):
+        source = NumberSource(99)
+        menu = self.menu(source, height=4)
+        menu._on_key("4")
+        assert strmenu(menu) == "(04) 14 24 34"
+        assert len(menu.options._cache) < 20
+
+    def test_interrupted(self):
+        read, write = os.pipe()
+        self.addCleanup(os.close, read)
+        self.addCleanup(os.close, write)
+        self.addCleanup(setattr, parallel, "_stdin_fileno", parallel._stdin_fileno)
+        # a key is waiting on the keyboard
+        os.write(write, b"x")
+        parallel._stdin_fileno = lambda: read
+        menu = self.menu(OPTIONS, height=4)
+        menu._on_key("4")
+        assert menu._plugins[1]._pending
+        assert strmenu(menu) == "(01) 02 03 04"
+        # keys that don't edit the query wait for its matches
+        menu._on_key("down")
+        assert strmenu(menu) == "04 (14) 24 34"
+        assert menu.get_result() == ["14"]
+
+    def test_dead_worker(self):
+        menu = self.menu(OPTIONS, height=4)
+        plugin = menu._plugins[1]
+        for start, conn, process in plugin._shards:
+            process.terminate()
+            process.join()
+        menu._on_key("4")
+        assert strmenu(menu) == "(04) 14 24 34"
+        assert plugin._shards == []
+
+class FuzzyFilterTest(unittest.TestCase):
+    FILES = ["README.md", "setup.py", "termenu/menu.py", "termenu/ansi.py", "scripts/termenu", "examples/paged_menu.py"]
+
+    def test_score(self):
+        assert fuzzy_score("mnu", "termenu/menu.py") is not None
+        assert fuzzy_score("xyz", "termenu/menu.py") is None
+        # consecutive and word start matches beat scattered ones
+        assert fuzzy_score("menu", "menu.py") > fuzzy_score("menu", "m_e_n_u.py")
+        assert fuzzy_score("mp", "menu.py") < fuzzy_score("mp", "my_plugin.py")
+
+    def test_ranking(self):
+        menu = Termenu(self.FILES, height=4, plugins=[FilterPlugin(fuzzy=True)])
+        menu._on_key("m")
+        menu._on_key("e")
+        menu._on_key("n")
+        menu._on_key("u")
+        assert strmenu(menu) == "(termenu/menu.py) examples/paged_menu.py termenu/ansi.py scripts/termenu"
+        menu._on_key(".")
+        assert strmenu(menu) == "(termenu/menu.py) examples/paged_menu.py termenu/ansi.py"
+        menu._on_key("backspace")
+        assert strmenu(menu) == "(termenu/menu.py) examples/paged_menu.py termenu/ansi.py scripts/termenu"
+
+    def test_limit(self):
+        menu = Termenu(OPTIONS, height=4, plugins=[FilterPlugin(fuzzy=True, limit=2)])
+        menu._on_key("1")
+        # matches at the start of the option rank first
+        assert strmenu(menu) == "(10) 11"
+
+    def test_groups(self):
+        options = [OptionGroup("Odd", ["one", "three", "neon"]), OptionGroup("Even", ["two", "xenon"])]
+        menu = Termenu(options, height=6, plugins=[FilterPlugin(fuzzy=True), OptionGroupPlugin()])
+        menu._on_key("n")
+        menu._on_key("o")
+        assert strmenu(menu) == "Odd (neon) Even xenon"
+
+class BenchmarkTest(unittest.TestCase):
+    def test_run(self):
+        results = benchmark.run_benchmarks([100], ["refilter", "keyboard"], repeat=1)
+        names = set(r["name"] for r in results)
+        assert names == set(["refilter", "refilter_fuzzy", "keyboard_decode"])
+        assert benchmark.result_id(results[0]) == "refilter[options=100,query=1]"
+
+    def test_compare(self):
+        baseline = [dict(name="a", params=dict(options=10), best=1.0), dict(name="b", params=dict(options=10), best=1.0)]
+        results = [dict(name="a", params=dict(options=10), best=1.2), dict(name="b", params=dict(options=10), best=1.5)]
+        assert benchmark.compare(results, baseline) == [("b[options=10]", 1.0, 1.5)]
+
+class VirtualScreenTest(unittest.TestCase):
+    def test_write_and_move(self):
+        screen = VirtualScreen(4, 10)
+        screen.feed("ab\r\ncd\r\x1b[1Ax\x1b[2;5Hy")
+        assert screen.lines() == ["xb", "cd  y"]
+
+    def test_clear_eol_and_colors(self):
+        screen = VirtualScreen(2, 10)
+        screen.feed("abcdef\r" + ansi.colorize("x", "red") + "\x1b[0K")
+        assert screen.lines() == ["x"]
+        assert screen.attrs[0][0] == (31, 49)
+        assert screen.attrs[0][1] == ()
+
+    def test_insert_delete_lines(self):
+        screen = VirtualScreen(4, 10)
+        screen.feed("0\r\n1\r\n2\r\n3\x1b[2;1H\x1b[1M")
+        assert screen.lines() == ["0", "2", "3"]
+        screen.feed("\x1b[2L")
+        assert screen.lines() == ["0", "", "", "2"]
+
+    def test_save_restore_and_scroll(self):
+        screen = VirtualScreen(2, 10)
+        screen.feed("a\x1b[s\r\nb\r\nc\x1b[uz")
+        assert screen.lines() == ["bz", "c"]
+
+    def test_split_sequence(self):
+        screen = VirtualScreen(2, 10)
+        screen.feed("a\x1b[")
+        screen.feed("1Cb")
+        assert screen.lines() == ["a b"]
+
+def show_numbers():
+    return Termenu(["%02d" % i for i in range(50)], height=5, multiselect=False, plugins=[FilterPlugin()]).show()
+
+def show_with_stats():
+    menu = Termenu(["%02d" % i for i in range(50)], height=5, multiselect=False)
+    stats = menu.enable_stats()
+    result = menu.show()
+    return [result] + [stats.histograms[name].to_dict() for name in ("write", "write_bytes", "write_syscalls")]
+
+def show_numbers_async():
+    import asyncio
+    async def main():
+        # another task keeps running while the menu waits for keys
+        ticks = []
+        async def tick():
+            while True:
+                ticks.append(None)
+                await asyncio.sleep(0.01)
+        ticker = asyncio.ensure_future(tick())
+        result = await Termenu(["%02d" % i for i in range(50)], height=5, multiselect=False, plugins=[FilterPlugin()]).show_async()
+        ticker.cancel()
+        return result, len(ticks) > 1
+    return asyncio.run(main())
+
+class HeadlessTest(unittest.TestCase):
+    def test_show(self):
+        terminal = HeadlessTerminal(show_numbers, rows=10, columns=20)
+        terminal.start()
+        assert terminal.screen.lines() == [" 00", " 01", " 02", " 03", " 04 v"]
+        frame = terminal.send("down", "down", "down", "down", "down", "down")
+        assert frame.bytes > 0
+        assert terminal.screen.lines() == [" 02 ^", " 03", " 04", " 05", " 06 v"]
+        terminal.send("4")
+        assert terminal.screen.lines()[:2] == [" 04", " 14"]
+        terminal.send("enter")
+        assert terminal.wait() == "04"
+        assert terminal.stats()["frames"] == 3
+
+    def test_show_async(self):
+        terminal = HeadlessTerminal(show_numbers_async, rows=10, columns=20)
+        terminal.start()
+        assert terminal.screen.lines() == [" 00", " 01", " 02", " 03", " 04 v"]
+        terminal.send("down")
+        terminal.send("1")
+        assert terminal.screen.lines()[:2] == [" 01", " 10"]
+        terminal.send("enter")
+        assert terminal.wait() == ("01", True)
+
+    def test_show_async_cancelled(self):
+        terminal = HeadlessTerminal(show_numbers_async, rows=10, columns=20)
+        terminal.start()
+        terminal.send("down")
+        terminal.send("esc")
+        assert terminal.wait() == (None, True)
+        assert terminal.screen.lines() == []
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,86 @@
+"""
+Trace menu sessions to a trace-event JSON file that can be opened with
+chrome://tracing or https://ui.perfetto.dev, by setting TERMENU_TRACE to the
+path of the file:
+
+    $ TERMENU_TRACE=/tmp/menu.json termenu ...
+
+Every key read, key handled, refilter, frame and terminal write is a span,
+as is every call of a @pluggable method, named after the plugin class that
+implements it.
+"""
+
+import os
+import json
+import atexit
+import threading
+from . import ansi
+from .instrument import clock
+
+ENVIRONMENT_VARIABLE = "TERMENU_TRACE"
+
+# all the menus of a process trace to the same file
+_tracer = None
+
+def from_environment():
+    """
+    Return the process's Tracer if tracing was requested, None otherwise.
+    """
+    global _tracer
+    path = os.environ.get(ENVIRONMENT_VARIABLE)
+    if not path:
+        return None
+    if _tracer is None:
+        _tracer = Tracer(path)
+        ansi.add_write_observer(_tracer._on_write)
+        atexit.register(_tracer.save)
+    return _tracer
+
+class Tracer(object):
+    def __init__(self, path):
+        self.path = path
+        self.events = []
+        self._pid = os.getpid()
+
+    def complete(self, name, start, end, args=None, category="termenu"):
+        """
+        Add a span that started and ended at the given clock() times.
+        """
+        event = dict(name=name, cat=category, ph="X", ts=start * 1e6, dur=(end - start) * 1e6,
+                     pid=self._pid, tid=threading.current_thread().ident)
+        if args:
+            event["args"] = args
+        self.events.append(event)
+
+    def wrap(self, name, method):
+        """
+        Return `method` reporting every call as a span called `name`.
+        """
+        def traced(*args, **kwargs):
+            start = clock()
+            try:
+                return method(*args, **kwargs)
+            finally:
+                self.complete(name, start, clock(), category="plugin")
+        return traced
+
+    def iterate(self, name, iterator):
+        """
+        Yield from `iterator`, reporting the wait for every item as a span.
+        """
+        iterator = iter(iterator)
+        while True:
+            start = clock()
+            try:
+                item = next(iterator)
+            except StopIteration:
+                return
+            self.complete(name, start, clock(), dict(keys=item), category="input")
+            yield item
+
+    def _on_write(self, size, syscalls, start, end):
+        self.complete("write", start, end, dict(bytes=size, syscalls=syscalls), category="output")
+
+    def save(self):
+        with open(self.path, "w") as f:
+            json.dump(dict(traceEvents=self.events, displayTimeUnit="ms"), f)